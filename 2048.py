@@ -11,9 +11,17 @@ Author: Hung Guei (moporgic)
 from board import board
 from action import action
 from episode import episode
+from bitboard import bitboard
 from statistic import statistic
 from agent import player, weight_agent
 from agent import rndenv
+import parallel
+import simulator
+import eplog
+from profiler import profiler
+from checkpoint import checkpointer
+import checkpoint
+import cProfile
 import sys
 
 
@@ -26,6 +34,14 @@ if __name__ == '__main__':
     play_args, evil_args = "", ""
     load, save = "", ""
     summary = False
+    actors, sync = 0, 100
+    workers = 0
+    lockstep = 0
+    log = ""
+    profile = ""
+    checkpoint_path, checkpoint_every, resume = "checkpoint.bin", 0, False
+    checkpoint_delta = 0
+    coverage = False
     for para in sys.argv[1:]:
         if "--total=" in para:
             total = int(para[(para.index("=") + 1):])
@@ -43,6 +59,30 @@ if __name__ == '__main__':
             save = para[(para.index("=") + 1):]
         elif "--summary" in para:
             summary = True
+        elif "--bitboard" in para:
+            episode.board = bitboard
+        elif "--actors=" in para:
+            actors = int(para[(para.index("=") + 1):])
+        elif "--sync=" in para:
+            sync = int(para[(para.index("=") + 1):])
+        elif "--workers=" in para:
+            workers = int(para[(para.index("=") + 1):])
+        elif "--log=" in para:
+            log = para[(para.index("=") + 1):]
+        elif "--checkpoint-every=" in para:
+            checkpoint_every = int(para[(para.index("=") + 1):])
+        elif "--checkpoint-delta=" in para:
+            checkpoint_delta = int(para[(para.index("=") + 1):])
+        elif "--checkpoint=" in para:
+            checkpoint_path = para[(para.index("=") + 1):]
+        elif "--resume" in para:
+            resume = True
+        elif "--coverage" in para:
+            coverage = True
+        elif "--profile" in para:
+            profile = para[(para.index("=") + 1):] if "=" in para else "on"
+        elif "--lockstep=" in para:
+            lockstep = int(para[(para.index("=") + 1):])
     
     stat = statistic(total, block, limit)
     
@@ -51,62 +91,87 @@ if __name__ == '__main__':
         stat.load(input)
         input.close()
         summary |= stat.is_finished()
+    if log:
+        stat.log = eplog.writer(log)
     memory_size = 1000
     print(play_args)
     play = weight_agent(play_args, memory_size = memory_size)
     evil = rndenv(evil_args)
+    if resume:
+        print("resuming from", checkpoint_path, "at episode", checkpoint.restore(checkpoint_path, play, evil, stat))
+    ckpt = checkpointer(checkpoint_path, checkpoint_every, checkpoint_delta)
+    if coverage:
+        for w in play.net:
+            w.cover()
+    if profile:
+        prof = profiler()
+        prof.install()
+        cprof = cProfile.Profile() if profile.endswith(".prof") else None
+        if cprof is not None:
+            cprof.enable()
 
+    if actors:
+        parallel.train(stat, play, play_args, evil_args, actors, sync, text = bool(save or log))
+    if workers:
+        parallel.evaluate(stat, play, evil, workers, text = bool(save or log))
+    if lockstep:
+        seed = evil.property("seed")
+        sim = simulator.simulator(lockstep, int(seed) if seed is not None else None)
+        if play.name() == "dummy":
+            policy = simulator.random_policy(sim.rng)
+        elif play.name() == "greedy":
+            policy = simulator.greedy_policy
+        elif play.name() == "expectimax":
+            raise ValueError("lockstep plays 1-ply policies only, expectimax is not supported")
+        else:
+            policy = simulator.weight_policy(play)
+        sim.run(policy, stat.total - stat.count, stat, play.name() + ":" + evil.name(), text = bool(save or log))
+    
     epoch = 1
     counter = 0
     while not stat.is_finished():
         if epoch % 50 == 0:
             print("Current epoch ",epoch)
         epoch += 1
-        state_index = []
-        after_state_index = []
-        rewards = []
-
         play.open_episode("~:" + evil.name())
         evil.open_episode(play.name() + ":~")
         
         stat.open_episode(play.name() + ":" + evil.name())
         game = stat.back()
-        player_lastslide = -1
-        state = None
-        while True:
-            who = game.take_turns(play, evil)
-            if who.info['role'] == "player":
-                move, slide_direction = who.take_action(game.state())
-                player_lastslide = slide_direction
-            else:
-                move = who.take_action(game.state(), player_lastslide)
-            
-            legal_action ,reward = game.apply_action(move)
-            if who.info['role'] == 'player':
-                if state == None:
-                    state = game.state().features()
-                else:
-                    state_index.append(state)
-                    after_state_index.append(game.state().features())
-                    rewards.append(reward)
-                    state = after_state_index[-1]
-
-            if not legal_action or who.check_for_win(game.state()):
-                break
+        afterstates, rewards = game.play(play, evil)
 
         win = game.last_turns(play, evil)
         stat.close_episode(win.name())
         
         play.close_episode(win.name())
-        play.update_weight(state_index, rewards, after_state_index)
+        features = play.layout.batch_features(afterstates)
+        play.update_weight(features[:-1], rewards, features[1:])
 
         evil.close_episode(win.name())
-    play.save_weight('weight.bin')
+        ckpt.step(play, evil, stat)
+    ckpt.wait()
+    if profile:
+        prof.uninstall()
+        if cprof is not None:
+            cprof.disable()
+            cprof.dump_stats(profile)
+        elif profile != "on":
+            prof.dump(profile)
+        print("profile of the whole run")
+        print(prof.summary())
+    if not play.test and not play.quantized: # evaluation runs leave weight.bin alone, it may hold the float tables of a quantized file
+        play.save_weight('weight.bin')
+    if play.cache is not None:
+        print(play.cache_report())
+    if coverage:
+        print(play.coverage_report())
     if summary:
         stat.summary()
     if save:
         output = open(save, "w")
         stat.save(output)
         output.close()
+    if log:
+        stat.log.close()
     
         
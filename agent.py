@@ -10,20 +10,73 @@ Author: Hung Guei (moporgic)
 
 from board import board
 from action import action
-from weight import weight
+from weight import weight, save_header, load_header, quantize, save_mapped, map_tables
+from bitboard import bitboard, canonical
+from collections import OrderedDict
+from simulator import slide_all
+import ntuple
+import search
 from array import array
 import random
+import os
 import numpy as np
 
 
+class stream:
+    """
+    a dedicated random generator that hands out uniform numbers in [0, 1) from pre-drawn blocks
+    it is a numpy PCG64 seeded by a SeedSequence, so the streams spawned from one seed are independent
+    """
+
+    def __init__(self, seed = None, size = 4096):
+        self.rng = np.random.Generator(np.random.PCG64(seed))
+        self.size = size
+        self.refill()
+        return
+
+    def refill(self):
+        self.start = self.rng.bit_generator.state # the state the block was drawn from
+        self.block = self.rng.random(self.size).tolist()
+        self.index = 0
+        return
+
+    def uniform(self):
+        if self.index == self.size:
+            self.refill()
+        u = self.block[self.index]
+        self.index += 1
+        return u
+
+    def choice(self, seq):
+        return seq[int(self.uniform() * len(seq))]
+
+    def shuffle(self, seq):
+        for i in range(len(seq) - 1, 0, -1):
+            j = int(self.uniform() * (i + 1))
+            seq[i], seq[j] = seq[j], seq[i]
+        return
+
+    def getstate(self):
+        """ the state as JSON data: the generator state of the current block and the position in it """
+        return {"start": self.start, "index": self.index, "size": self.size}
+
+    def setstate(self, state):
+        self.rng.bit_generator.state = state["start"]
+        self.size = state["size"]
+        self.refill()
+        self.index = state["index"]
+        return
+
+
 class bag:
-    def __init__(self):
+    def __init__(self, rng = None):
+        self.rng = rng if rng is not None else stream()
         self.tile_bag = self._initial_bag()
     
     def choose_tile(self):
         if self.tile_bag == []:
             self.tile_bag = self._initial_bag()
-        choose_tile = random.choice(self.tile_bag)
+        choose_tile = self.rng.choice(self.tile_bag)
         self.tile_bag.remove(choose_tile)
         return choose_tile
 
@@ -74,26 +127,34 @@ class agent:
 
 
 class random_agent(agent):
-    """ base agent for agents with random behavior """
+    """
+    base agent for agents with random behavior
+    each agent owns its random streams, spawned from 'seed=' (and 'stream=', the index of a parallel worker)
+    """
     
     def __init__(self, options = ""):
         super().__init__(options)
+        index = self.property("stream")
+        self.reseed(int(index) if index is not None else None)
+        return
+    
+    def reseed(self, index = None):
+        """ restart the random streams of this agent as those of option 'stream=index' """
         seed = self.property("seed")
-        if seed is not None:
-            random.seed(int(seed))
-        self.rstate = random.getstate()
+        self.seed = np.random.SeedSequence(int(seed) if seed is not None else None,
+                                           spawn_key = (index,) if index is not None else ())
+        self.rng = self.spawn()
         return
     
+    def spawn(self):
+        """ a new stream independent of the others of this agent """
+        return stream(self.seed.spawn(1)[0])
+    
     def choice(self, seq):
-        random.setstate(self.rstate)
-        target = random.choice(seq)
-        self.rstate = random.getstate()
-        return target
+        return self.rng.choice(seq)
     
     def shuffle(self, seq):
-        random.setstate(self.rstate)
-        random.shuffle(seq)
-        self.rstate = random.getstate()
+        self.rng.shuffle(seq)
         return
 
 
@@ -107,10 +168,14 @@ class rndenv(random_agent):
     
     def __init__(self, options = ""):
         super().__init__("name=random role=environment " + options)
-        self.bag = bag()
         
         return
     
+    def reseed(self, index = None):
+        super().reseed(index)
+        self.bag = bag(self.spawn())
+        return
+    
     def take_action(self, state, player_slide = None):
         #print(state)
         if player_slide != -1:
@@ -152,12 +217,12 @@ class player(random_agent):
     
     def take_action(self, state):
         if self.info['name'] == 'dummy':
-            legal = [op for op in range(4) if board(state).slide(op) != -1]
+            legal = [op for op, (after, reward, valid) in enumerate(state.afterstates()) if valid]
             if legal:
                 op = self.choice(legal)
                 return action.slide(op), op
         elif self.info['name'] == 'greedy':
-            score_array = [board(state).slide(op) for op in range(4)]
+            score_array = [reward for after, reward, valid in state.afterstates()]
             greedy_op = np.argmax(score_array)
             if score_array[greedy_op] != -1:
                 return action.slide(greedy_op), greedy_op
@@ -173,6 +238,23 @@ class weight_agent(random_agent):
         self.memory_size = memory_size
         alpha = self.property('alpha')
         self.test = False
+        self.quantized = False # the tables are int16/float16 with a scale, for inference only
+        self.mapped = False # the tables were loaded from a mapped weight file, they are saved as one again
+        self.exact = self.property('update') == 'exact'
+        td_lambda, tc = self.property('lambda'), self.property('tc')
+        self.td_lambda = float(td_lambda) if td_lambda is not None else 0.0 # 0 is TD(0)
+        self.coherence = tc is not None and tc not in ['0', 'off'] # temporal coherence learning rates
+        self.version = 0 # bumped whenever the weights are updated
+        cache = self.property('cache')
+        if cache is True:
+            raise ValueError("the option 'cache' needs a size, e.g. 'cache=100000'")
+        self.cache_size = max(int(cache), 0) if cache is not None else 0
+        self.cache = OrderedDict() if self.cache_size > 0 else None # cache=0 (or less) is off
+        self.cache_version = 0
+        self.cache_hits, self.cache_misses, self.cache_evictions = 0, 0, 0
+        self.layout = ntuple.load(self.property('tuples'))
+        if self.coherence:
+            self.alpha = 1.0 / len(self.layout) # the meta learning rate, the rates |E| / A shrink by themselves
         if alpha is not None:
             self.alpha = float(alpha)
         load = self.property('load')
@@ -183,89 +265,301 @@ class weight_agent(random_agent):
         if load is not None:
             self.load_weight(load)
             self.test = True
+        self.link_tables()
+        if self.info['name'] == 'expectimax':
+            budget, depth = self.property('budget'), self.property('depth')
+            self.search = search.expectimax(self, float(budget) if budget is not None else 10,
+                                            int(depth) if depth is not None else 3)
         train = self.property('train')
         print(train)
         if train is not None:
             self.test = False
         if self.test:
             self.epsilon = 1
+        if self.quantized and not self.test:
+            raise ValueError("quantized tables are for inference only, they cannot be trained")
         print("net size :",len(self.net[0]))
         return 
+    def open_episode(self, flag = ""):
+        if self.info['name'] == 'expectimax':
+            self.search.open_episode()
+        return
+    def close_episode(self, flag = ""):
+        if self.info['name'] == 'expectimax':
+            print(self.search.report())
+        return
     def __exit__(self, exc_type, exc_value, traceback):
         save = self.property('save')
         if save is not None:
             self.save_weight(save)
         return 
     def init_weight(self, init):
-        for i in range(len(board.feature_index)):
+        for i in range(len(self.layout.patterns)):
             self.net += [weight(int(init))]
+            self.net[-1].coherence(self.coherence)
     def load_weight(self, init):
-        input = open(init, 'rb')
-        size = array('I')
-        size.fromfile(input, 1)
-        size = size[0]
-        for i in range(size):
-            self.net += [weight()]
-            self.net[-1].load(input)
+        """
+        load the tables, a file without a header holds the 31 tables of the legacy layout
+        the tables of a mapped weight file (see save_mapped) are mapped in place instead of read, read-only unless training
+        """
+        with open(init, 'rb') as input:
+            header = load_header(input)
+            self.layout = ntuple.from_config(header['layout']) if header is not None else ntuple.legacy()
+            quantized = header.get('quantize') if header is not None else None
+            coherence = header is not None and header.get('coherence', False)
+            self.quantized = quantized is not None
+            self.mapped = header is not None and 'tables' in header
+            if self.mapped:
+                tables = map_tables(init, header, input.tell(), 'r' if self.property('train') is None else 'c')
+            else:
+                size = array('I')
+                size.fromfile(input, 1)
+                tables = [None] * size[0]
+            if len(tables) != len(self.layout.patterns):
+                raise ValueError("%d tables in %s, but the layout has %d" % (len(tables), init, len(self.layout.patterns)))
+            for i, value in enumerate(tables):
+                self.net += [weight()]
+                if value is not None:
+                    self.net[-1].value = value
+                elif quantized is not None:
+                    self.net[-1].load(input, np.dtype(quantized['dtype']))
+                else:
+                    self.net[-1].load(input, coherence = coherence)
+                if quantized is not None:
+                    self.net[-1].scale = quantized['scale'][i]
+                self.net[-1].coherence(self.coherence) # keep E and A only if they are used
         
         return 
     def save_weight(self, path):
-        output = open(path, 'wb')
-        array('I', [len(self.net)]).tofile(output)
-
-        for w in self.net:
-            w.save(output)
+        """
+        save the tables, with a header of the tuple layout unless it is the legacy layout
+        with temporal coherence, the E and A arrays of each table follow it, and the header says so
+        the file is written aside and renamed over 'path', which may be mapped by this or other processes
+        tables loaded from a mapped weight file are saved in that format (unless E and A must be kept)
+        """
+        if self.mapped and not self.coherence:
+            self.save_mapped(path)
+            return
+        with open(path + ".tmp", 'wb') as output:
+            if self.quantized:
+                save_header(output, {'layout': self.layout.config(),
+                                     'quantize': {'dtype': self.net[0].value.dtype.name, 'scale': [w.scale for w in self.net]}})
+            elif self.coherence:
+                save_header(output, {'layout': self.layout.config(), 'coherence': True})
+            elif self.layout.name != 'legacy':
+                save_header(output, {'layout': self.layout.config()})
+            array('I', [len(self.net)]).tofile(output)
+            
+            for w in self.net:
+                w.save(output)
+        os.replace(path + ".tmp", path)
         return 
+    def save_mapped(self, path):
+        """ save the tables as a mapped weight file, which load_weight maps in place instead of reading """
+        header = {'layout': self.layout.config()}
+        if self.quantized:
+            header['quantize'] = {'dtype': self.net[0].value.dtype.name, 'scale': [w.scale for w in self.net]}
+        with open(path + ".tmp", 'wb') as output:
+            save_mapped(output, header, [w.value for w in self.net])
+        os.replace(path + ".tmp", path)
+        return
+    def save_quantized(self, path, dtype = 'int16'):
+        """ export the tables quantized to int16 or float16 with a scale per table, for inference only """
+        tables = [quantize(w.value, dtype) for w in self.net]
+        with open(path, 'wb') as output:
+            save_header(output, {'layout': self.layout.config(),
+                                 'quantize': {'dtype': np.dtype(dtype).name, 'scale': [scale for value, scale in tables]}})
+            array('I', [len(tables)]).tofile(output)
+            for value, scale in tables:
+                w = weight()
+                w.value = value
+                w.save(output)
+        return
+    def link_tables(self):
+        """ map each tuple of the layout to its (possibly shared) table """
+        self.lookup = [self.net[t] for t in self.layout.table]
+        return
     def update_weight(self, state_index, rewards, after_state_index):
+        """
+        TD(0) update over an episode, rows of 'state_index' are the afterstates of the player,
+        'rewards' and 'after_state_index' are the rewards and the next afterstates,
+        a reward of -1 marks the terminal step
+        
+        by default all TD errors of the episode are computed with the weights before the update
+        and scattered into the tables at once, option 'update=exact' applies them one by one backwards
+        
+        option 'lambda' uses the lambda-returns of the episode as the targets, TD(lambda),
+        option 'tc' scales the step of each entry by its temporal coherence rate |E| / A
+        """
         self.epsilon += 0.0004
         if self.test:
             return
+        self.version += 1
+        if not self.exact:
+            self.update_batch(state_index, rewards, after_state_index)
+            return
+        state_index, after_state_index = np.asarray(state_index).tolist(), np.asarray(after_state_index).tolist()
+        target = self.sum(after_state_index[-1]) if self.td_lambda and state_index else 0 # the last step bootstraps from its afterstate
         for i in reversed(range(len(state_index))):
             if rewards[i] == -1:
-                delta = self.alpha * (0 - self.sum(state_index[i]))
+                target = 0
+            elif self.td_lambda:
+                target = rewards[i] + (1 - self.td_lambda) * self.sum(after_state_index[i]) + self.td_lambda * target
             else:
-                delta = self.alpha * (rewards[i] + self.sum(after_state_index[i]) - self.sum(state_index[i]))
-            for j, index in enumerate(state_index[i]):
-                self.net[j][index] += delta
+                target = rewards[i] + self.sum(after_state_index[i])
+            error = target - self.sum(state_index[i])
+            for w, index in zip(self.lookup, state_index[i]):
+                if self.coherence:
+                    w.adapt(index, error, self.alpha)
+                else:
+                    w[index] += self.alpha * error
 
         return 
+    def update_batch(self, state_index, rewards, after_state_index):
+        rewards = np.asarray(rewards, dtype = np.float64)
+        if not len(rewards):
+            return
+        state_index = np.asarray(state_index).reshape(len(rewards), -1)
+        after_state_index = np.asarray(after_state_index).reshape(len(rewards), -1)
+        after = self.sum_batch(after_state_index)
+        if self.td_lambda:
+            target = self.returns(rewards, after)
+        else:
+            target = np.where(rewards == -1, 0.0, rewards + after)
+        error = target - self.sum_batch(state_index)
+        for j, w in enumerate(self.lookup):
+            if self.coherence:
+                w.adapt(state_index[:, j], error, self.alpha)
+            else:
+                w.add(state_index[:, j], self.alpha * error)
+        return
+    def returns(self, rewards, after):
+        """
+        the lambda-returns of the steps of an episode, from the rewards and the values of the next afterstates
+        G(t) = r(t) + (1 - lambda) * V(s(t + 1)) + lambda * G(t + 1), the last step bootstraps with V(s(T))
+        """
+        td_lambda = self.td_lambda
+        result = [0.0] * len(rewards)
+        target = after[-1]
+        for i, (reward, value) in reversed(list(enumerate(zip(rewards.tolist(), after.tolist())))):
+            target = 0.0 if reward == -1 else reward + (1 - td_lambda) * value + td_lambda * target
+            result[i] = target
+        return np.array(result)
     def get_weight(self):
         return self.net[0]
     def take_action(self, state):
         
         if self.info['name'] == 'dummy':
-            legal = [op for op in range(4) if board(state).slide(op) != -1]
+            legal = [op for op, (after, reward, valid) in enumerate(state.afterstates()) if valid]
             if legal:
                 op = self.choice(legal)
                 return action.slide(op), op
         elif self.info['name'] == 'greedy':
-            score_array = [board(state).slide(op) for op in range(4)]
+            score_array = [reward for after, reward, valid in state.afterstates()]
             greedy_op = np.argmax(score_array)
             if score_array[greedy_op] != -1:
                 return action.slide(greedy_op), greedy_op
         elif self.info['name'] == 'td_learning':
-            if np.random.uniform() < self.epsilon:
-                all_values = []
-                rewards = []
-                for op in range(4):
-                    tmp_board = board(state)
-                    reward = tmp_board.slide(op)
-                    rewards.append(reward)
-                    all_values.append(self.sum(tmp_board.features()) + reward)
-                
-                legal = [op for op in range(4) if rewards[op] != -1]
+            afterstates = state.afterstates()
+            legal = [op for op, (after, reward, valid) in enumerate(afterstates) if valid]
+            if self.rng.uniform() < self.epsilon:
                 if legal:
-                    op = legal[np.argmax([all_values[op] for op in legal])]
+                    all_values = [self.value(afterstates[op][0]) + afterstates[op][1] for op in legal]
+                    op = legal[np.argmax(all_values)]
                     return action.slide(op), op
             else:
-                legal = [op for op in range(4) if board(state).slide(op) != -1]
                 if legal:
                     op = self.choice(legal)
                     return action.slide(op), op
+        elif self.info['name'] == 'expectimax':
+            op = self.search.take_action(state)
+            if op != -1:
+                return action.slide(op), op
         return action(), -1
 
+    def value(self, state):
+        """
+        the value of an afterstate
+        with option 'cache=N', values are kept in an LRU cache of N entries keyed by the board,
+        canonicalized under the 8 isomorphisms if the layout is symmetric, and dropped once the weights change
+        """
+        if self.cache is None:
+            return self.sum(self.layout.features(state))
+        raw = state.raw if isinstance(state, bitboard) else bitboard(state).raw
+        key = canonical(raw) if self.layout.symmetric else raw
+        if self.cache_version != self.version:
+            self.cache.clear()
+            self.cache_version = self.version
+        value = self.cache.get(key)
+        if value is not None:
+            self.cache.move_to_end(key)
+            self.cache_hits += 1
+            return value
+        self.cache_misses += 1
+        value = self.sum(self.layout.features(state))
+        if len(self.cache) >= self.cache_size:
+            self.cache.popitem(last = False)
+            self.cache_evictions += 1
+        self.cache[key] = value
+        return value
+
+    def coverage_report(self):
+        """ how much of each table is used, i.e. has been changed by some update since the tables called cover() """
+        lines = []
+        for i, w in enumerate(self.net):
+            used = w.coverage()
+            lines += ["table %d: %d/%d entries used (%.2f%%)" % (i, used, len(w), used * 100 / max(len(w), 1))]
+        used, size = sum(w.coverage() for w in self.net), sum(len(w) for w in self.net)
+        lines += ["total: %d/%d entries used (%.2f%%)" % (used, size, used * 100 / max(size, 1))]
+        return "\n".join(lines)
+
+    def cache_report(self):
+        """ the counters of the value cache """
+        lookups = max(self.cache_hits + self.cache_misses, 1)
+        return "cache: %d/%d entries, %d hits (%.1f%%), %d misses, %d evictions" % (
+               len(self.cache), self.cache_size, self.cache_hits, self.cache_hits * 100 / lookups,
+               self.cache_misses, self.cache_evictions)
+
     def sum(self, indices):
-        return sum([self.net[i][index] for i,index in enumerate(indices)])
+        if self.quantized:
+            return sum([w.value.item(index) * w.scale for w, index in zip(self.lookup, indices)])
+        return sum([w.value.item(index) for w, index in zip(self.lookup, indices)])
+
+    def sum_batch(self, indices):
+        """ the values of many afterstates, 'indices' is an (N, tuples) array of weight indices """
+        total = np.zeros(len(indices))
+        for i, w in enumerate(self.lookup):
+            total += w.value[indices[:, i]].astype(np.float64) * w.scale if self.quantized else w.value[indices[:, i]]
+        return total
+
+    def evaluate_batch(self, boards):
+        """
+        the reward + afterstate value of the four slides of many boards at once
+        'boards' is a (K, 16) array of tile indices, or a list of boards
+        return a (K, 4) float64 array indexed by opcode (-inf for an illegal slide) and the (K, 4, 16) afterstates
+
+        the values are exactly value(afterstate) + reward of take_action, the tables are summed in the same order
+        """
+        if len(boards) and not isinstance(boards, np.ndarray) and hasattr(boards[0], 'state'):
+            boards = [state.state for state in boards]
+        boards = np.asarray(boards, dtype = np.uint8).reshape(-1, 16)
+        after, reward = slide_all(boards)
+        values = self.sum_batch(self.layout.batch_features(after.reshape(-1, 16))).reshape(-1, 4) + reward
+        return np.where(reward != -1, values, -np.inf), after
+
+    def act_batch(self, boards, legal_masks = None):
+        """
+        the best opcode and its value for each of many boards, the same as take_action of td_learning without exploration
+        'legal_masks' is an optional (K, 4) bool array of the slides to consider
+        return the (K,) opcodes (-1 if no slide is legal) and the (K,) values (0 if none)
+        """
+        values, after = self.evaluate_batch(boards)
+        if legal_masks is not None:
+            values = np.where(legal_masks, values, -np.inf)
+        op = np.argmax(values, axis = 1) # the first maximum, as np.argmax over the legal slides in take_action
+        best = values[np.arange(len(values)), op]
+        legal = best != -np.inf
+        return np.where(legal, op, -1), np.where(legal, best, 0.0)
 
 
 if __name__ == '__main__':
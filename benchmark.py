@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark suite of the engine and the learner, with fixed seeds and JSON results
+"""
+
+from board import board
+from bitboard import bitboard
+from episode import episode
+from statistic import statistic
+from agent import weight_agent, rndenv, player
+import contextlib
+import platform
+import random
+import json
+import time
+import sys
+import io
+import numpy as np
+
+
+def measure(run, count, repeat = 5, setup = None):
+    """
+    the time per operation in ns, the best of 'repeat' runs
+    each run calls run(setup()) which performs 'count' operations, the setup is not timed
+    """
+    best = None
+    for i in range(repeat):
+        data = setup() if setup is not None else None
+        tick = time.perf_counter_ns()
+        run(data)
+        elapsed = time.perf_counter_ns() - tick
+        best = elapsed if best is None else min(best, elapsed)
+    return best / max(count, 1)
+
+
+def quiet():
+    """ suppress the prints of the agents and the statistic """
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def corpus(games, seed):
+    """ the boards before each player move of 'games' random games, with fixed seeds """
+    with quiet():
+        play = player("name=dummy seed=%d" % seed)
+        evil = rndenv("seed=%d" % (seed + 1))
+    states = []
+    for i in range(games):
+        game = episode()
+        evil.open_episode()
+        last = -1
+        while True:
+            who = game.take_turns(play, evil)
+            if who is play:
+                states += [game.state().state[:]]
+                move, last = play.take_action(game.state())
+            else:
+                move = evil.take_action(game.state(), last)
+            legal, reward = game.apply_action(move)
+            if not legal:
+                break
+    return states
+
+
+def agents(options, seed):
+    """ a td_learning agent with random weights, and the other player types sharing its tables """
+    with quiet():
+        td = weight_agent("name=td_learning init=1771561 seed=%d %s" % (seed, options))
+        rng = np.random.default_rng(seed)
+        for w in td.net:
+            w.value[:] = rng.random(len(w), dtype = np.float32)
+        td.test = True
+        result = {"td_learning": td}
+        for name in ["dummy", "greedy", "expectimax"]:
+            other = weight_agent("name=%s init=1 seed=%d budget=1000 depth=1 %s" % (name, seed, options))
+            other.net = td.net
+            other.link_tables()
+            result[name] = other
+    return result
+
+
+def run(repeat = 5, games = 50, episodes = 50, options = "", seed = 1):
+    """ run all benchmarks, return a dict of name -> ns per operation """
+    results = {}
+    random.seed(seed)
+    np.random.seed(seed)
+    states = corpus(games, seed)
+
+    # board primitives
+    for impl in [board, bitboard]:
+        name = impl.__name__
+        fresh = lambda: [impl(s) for s in states]
+        for op, direction in enumerate(["up", "right", "down", "left"]):
+            results[name + ".slide." + direction] = measure(lambda boards: [b.slide(op) for b in boards], len(states), repeat, fresh)
+        results[name + ".afterstates"] = measure(lambda boards: [b.afterstates() for b in boards], len(states), repeat, fresh)
+        results[name + ".features"] = measure(lambda boards: [b.features() for b in boards], len(states), repeat, fresh)
+
+    # the value of the network
+    net = agents(options, seed)
+    td = net["td_learning"]
+    features = [td.layout.features(board(s)) for s in states]
+    results["weight_agent.sum"] = measure(lambda data: [td.sum(f) for f in features], len(features), repeat)
+    batch = np.array(features)
+    results["weight_agent.sum_batch"] = measure(lambda data: td.sum_batch(batch), len(features), repeat)
+
+    # agents
+    for name, agent in net.items():
+        sample = states if name != "expectimax" else states[:max(len(states) // 20, 1)]
+        def act(boards):
+            for b in boards:
+                agent.open_episode() # the search forgets its transposition table
+                agent.take_action(b)
+        results["take_action." + name] = measure(act, len(sample), repeat, lambda: [board(s) for s in sample])
+    with quiet():
+        evil = rndenv("seed=%d" % seed)
+    results["rndenv.take_action"] = measure(lambda boards: [evil.take_action(b, i % 5 - 1) for i, b in enumerate(boards)],
+                                            len(states), repeat, lambda: [board(s) for s in states])
+
+    # learning, on the trajectories of td_learning in test mode
+    trajectories = []
+    with quiet():
+        evil = rndenv("seed=%d" % (seed + 2))
+    for i in range(episodes):
+        game = episode()
+        afterstates, rewards = game.play(td, evil)
+        trajectories += [(td.layout.batch_features(afterstates), rewards)]
+    steps = sum(len(rewards) for f, rewards in trajectories)
+    def learn(data):
+        td.test = False
+        for f, rewards in trajectories:
+            td.update_weight(f[:-1], rewards, f[1:])
+        td.test = True
+    results["update_weight.step"] = measure(learn, steps, repeat)
+    td.td_lambda = 0.5
+    results["update_weight.step.lambda"] = measure(learn, steps, repeat)
+    td.td_lambda, td.coherence = 0.0, True
+    for w in td.net:
+        w.coherence()
+    results["update_weight.step.tc"] = measure(learn, steps, repeat)
+    td.coherence = False
+    for w in td.net:
+        w.coherence(False)
+
+    # episode text
+    with quiet():
+        stat = statistic(0)
+        stat.load(io.StringIO("".join(str(ep) + "\n" for ep in recorded(td, episodes, seed))))
+    text = str(stat)
+    results["statistic.load.episode"] = measure(lambda data: statistic(0).load(io.StringIO(text)), len(stat.data), repeat)
+    results["statistic.save.episode"] = measure(lambda data: stat.save(io.StringIO()), len(stat.data), repeat)
+
+    # the training loop of 2048.py, end to end
+    results["2048.episode"] = measure(loop, episodes, max(repeat // 2, 1), lambda: setup(options, episodes, seed))
+    return results
+
+
+def recorded(play, episodes, seed):
+    """ play 'episodes' episodes with timestamps, as 2048.py would record them """
+    with quiet():
+        evil = rndenv("seed=%d" % (seed + 3))
+    result = []
+    for i in range(episodes):
+        game = episode()
+        game.open_episode(play.name() + ":" + evil.name())
+        game.play(play, evil)
+        game.close_episode(game.last_turns(play, evil).name())
+        result += [game]
+    return result
+
+
+def setup(options, episodes, seed):
+    """ the agents and the statistic of 2048.py, training a td_learning agent """
+    with quiet():
+        play = weight_agent("name=td_learning init=1771561 seed=%d %s" % (seed, options))
+        evil = rndenv("seed=%d" % (seed + 1))
+    return play, evil, statistic(episodes, episodes)
+
+
+def loop(data):
+    """ the main loop of 2048.py """
+    play, evil, stat = data
+    with quiet():
+        while not stat.is_finished():
+            play.open_episode("~:" + evil.name())
+            evil.open_episode(play.name() + ":~")
+            stat.open_episode(play.name() + ":" + evil.name())
+            game = stat.back()
+            afterstates, rewards = game.play(play, evil)
+            win = game.last_turns(play, evil)
+            stat.close_episode(win.name())
+            play.close_episode(win.name())
+            features = play.layout.batch_features(afterstates)
+            play.update_weight(features[:-1], rewards, features[1:])
+            evil.close_episode(win.name())
+    return
+
+
+def learning(episodes, block, learners, options = "", seed = 1):
+    """
+    train a td_learning agent with each of 'learners' (extra options, e.g. "lambda=0.5 tc") on the same seeds
+    return a dict of learner -> [cpu seconds, average score] at the end of each block of 'block' episodes
+    """
+    curves = {}
+    for learner in learners:
+        with quiet():
+            play = weight_agent("name=td_learning init=1771561 seed=%d train %s %s" % (seed, options, learner))
+            evil = rndenv("seed=%d" % (seed + 1))
+        curve, scores = [], []
+        cpu = 0.0
+        for i in range(episodes):
+            tick = time.process_time()
+            play.open_episode("~:" + evil.name())
+            evil.open_episode(play.name() + ":~")
+            game = episode()
+            game.open_episode(play.name() + ":" + evil.name())
+            afterstates, rewards = game.play(play, evil)
+            game.close_episode(game.last_turns(play, evil).name())
+            features = play.layout.batch_features(afterstates)
+            play.update_weight(features[:-1], rewards, features[1:])
+            cpu += time.process_time() - tick
+            scores += [game.score()]
+            if (i + 1) % block == 0:
+                curve += [[cpu, float(np.mean(scores[-block:]))]]
+        curves[learner if learner else "td(0)"] = curve
+    return curves
+
+
+def show_learning(curves):
+    """ print the average score of each block of each learner, and the cpu seconds it took to get there """
+    width = {name: max(24, len(name) + 2) for name in curves}
+    print("%-6s" % "block" + "".join(name.rjust(width[name]) for name in curves))
+    for b in range(max(len(curve) for curve in curves.values())):
+        print("%-6d" % (b + 1) + "".join(("%.1f @ %6.1fs" % (curves[name][b][1], curves[name][b][0]) if b < len(curves[name]) else "-").rjust(width[name])
+                                        for name in curves))
+    return
+
+
+def compare(base, result, threshold = 0.2):
+    """ print the ratio of each benchmark, return the names slower than 'base' by more than 'threshold' """
+    regressions = []
+    print("%-28s %14s %14s %8s" % ("benchmark", "base ns/op", "ns/op", "ratio"))
+    for name in sorted(set(base) | set(result)):
+        if name not in base or name not in result:
+            print("%-28s %14s %14s" % (name, base.get(name, "-"), result.get(name, "-")))
+            continue
+        ratio = result[name] / max(base[name], 1e-9)
+        flag = ""
+        if ratio > 1 + threshold:
+            regressions += [name]
+            flag = "  REGRESSION"
+        print("%-28s %14.1f %14.1f %7.2fx%s" % (name, base[name], result[name], ratio, flag))
+    return regressions
+
+
+if __name__ == '__main__':
+    print('Threes Demo: benchmark.py\n')
+
+    output, baseline, input = "benchmark.json", None, None
+    repeat, games, episodes, seed = 5, 50, 50, 1
+    threshold = 0.2
+    options = ""
+    train, learners = 0, ["", "lambda=0.5", "tc", "tc lambda=0.5"]
+    for para in sys.argv[1:]:
+        if "--output=" in para:
+            output = para[(para.index("=") + 1):]
+        elif "--compare=" in para:
+            baseline = para[(para.index("=") + 1):]
+        elif "--input=" in para:
+            input = para[(para.index("=") + 1):]
+        elif "--threshold=" in para:
+            threshold = float(para[(para.index("=") + 1):])
+        elif "--repeat=" in para:
+            repeat = int(para[(para.index("=") + 1):])
+        elif "--games=" in para:
+            games = int(para[(para.index("=") + 1):])
+        elif "--episodes=" in para:
+            episodes = int(para[(para.index("=") + 1):])
+        elif "--seed=" in para:
+            seed = int(para[(para.index("=") + 1):])
+        elif "--tuples=" in para:
+            options = "tuples=" + para[(para.index("=") + 1):]
+        elif "--learning=" in para:
+            train = int(para[(para.index("=") + 1):])
+        elif "--learners=" in para:
+            learners = [learner.replace("+", " ") for learner in para[(para.index("=") + 1):].split(",")]
+
+    if train:
+        tick = time.time()
+        curves = learning(train, max(train // 10, 1), learners, options, seed)
+        show_learning(curves)
+        with open(output, "w") as file:
+            json.dump({"meta": {"python": platform.python_version(), "numpy": np.__version__, "machine": platform.machine(),
+                                "date": time.strftime("%Y-%m-%d %H:%M:%S"), "seed": seed, "episodes": train,
+                                "options": options, "unit": "[cpu sec, avg score] per block"},
+                       "learning": curves}, file, indent = 2)
+        print("\n%d learners in %.1f sec, saved to %s\n" % (len(curves), time.time() - tick, output))
+        sys.exit(0)
+
+    if input is None:
+        tick = time.time()
+        results = run(repeat, games, episodes, options, seed)
+        report = {"meta": {"python": platform.python_version(), "numpy": np.__version__, "machine": platform.machine(),
+                           "date": time.strftime("%Y-%m-%d %H:%M:%S"), "seed": seed, "repeat": repeat,
+                           "games": games, "episodes": episodes, "options": options, "unit": "ns/op"},
+                  "results": results}
+        with open(output, "w") as file:
+            json.dump(report, file, indent = 2)
+        for name, value in results.items():
+            print("%-28s %14.1f ns/op" % (name, value))
+        print("\n%d benchmarks in %.1f sec, saved to %s\n" % (len(results), time.time() - tick, output))
+    else:
+        with open(input, "r") as file:
+            results = json.load(file)["results"]
+
+    if baseline is not None:
+        with open(baseline, "r") as file:
+            base = json.load(file)["results"]
+        regressions = compare(base, results, threshold)
+        if regressions:
+            print("\n%d regressions beyond %.0f%%: %s" % (len(regressions), threshold * 100, ", ".join(regressions)))
+            sys.exit(1)
+        print("\nno regression beyond %.0f%%" % (threshold * 100))
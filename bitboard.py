@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+
+"""
+64-bit packed board for Threes, with precomputed row-slide tables
+"""
+
+from board import board, index_to_score
+
+
+def slide_row(row):
+    """
+    slide a single row (list of 4 tile indices) to the left
+    return the resulting row and the merge reward, the same rule as board.slide_left
+    """
+    move, score = [], 0
+    buf = row + [0]
+    merge = False
+    while buf[0] and not merge:
+        if buf[0] == buf[1] and buf[0] > 2 and buf[0] < 15:
+            # index 15 is the largest tile a 4-bit cell can hold
+            buf = buf[1:]
+            buf[0] += 1
+            merge = True
+            score += index_to_score[buf[0]] if buf[0] < 15 else index_to_score[14] * 3
+        elif buf[0] > 0 and buf[1] > 0 and buf[0] + buf[1] == 3:
+            buf = buf[1:]
+            buf[0] = 3
+            score += index_to_score[buf[0]]
+            merge = True
+        move += [buf[0]]
+        if not merge:
+            buf = buf[1:]
+    move += buf[1:]
+    return move, score
+
+
+def pack_row(row):
+    return row[0] | (row[1] << 4) | (row[2] << 8) | (row[3] << 12)
+
+
+def unpack_row(value):
+    return [(value >> s) & 0x0f for s in range(0, 16, 4)]
+
+
+def reverse_row(value):
+    return ((value & 0x000f) << 12) | ((value & 0x00f0) << 4) | ((value & 0x0f00) >> 4) | ((value & 0xf000) >> 12)
+
+
+def _build_tables():
+    """ precompute left/right slide results and rewards for all 65536 rows """
+    left_row, left_score = [0] * 65536, [0] * 65536
+    for value in range(65536):
+        row, score = slide_row(unpack_row(value))
+        left_row[value] = pack_row(row)
+        left_score[value] = score
+    right_row, right_score = [0] * 65536, [0] * 65536
+    for value in range(65536):
+        rev = reverse_row(value)
+        right_row[value] = reverse_row(left_row[rev])
+        right_score[value] = left_score[rev]
+    return tuple(left_row), tuple(left_score), tuple(right_row), tuple(right_score)
+
+row_left, score_left, row_right, score_right = _build_tables()
+
+
+def transpose(raw):
+    """ transpose a packed board, cell (r, c) <--> cell (c, r) """
+    a1 = raw & 0xF0F00F0FF0F00F0F
+    a2 = raw & 0x0000F0F00000F0F0
+    a3 = raw & 0x0F0F00000F0F0000
+    a = a1 | (a2 << 12) | (a3 >> 12)
+    b1 = a & 0xFF00FF0000FF00FF
+    b2 = a & 0x00FF00FF00000000
+    b3 = a & 0x00000000FF00FF00
+    return b1 | (b2 >> 24) | (b3 << 24)
+
+
+def canonical(raw):
+    """ the smallest packed value among the 8 isomorphisms (rotations and reflections) of a packed board """
+    state = bitboard(raw)
+    best = raw
+    for reflect in range(2):
+        for rot in range(4):
+            best = min(best, state.raw)
+            state.rotate_right()
+        state.reflect_horizontal()
+    return best
+
+
+def slide_raw(raw, table, score):
+    """ slide all four rows of a packed board with the given row tables """
+    r0, r1, r2, r3 = raw & 0xffff, (raw >> 16) & 0xffff, (raw >> 32) & 0xffff, raw >> 48
+    move = table[r0] | (table[r1] << 16) | (table[r2] << 32) | (table[r3] << 48)
+    return move, score[r0] + score[r1] + score[r2] + score[r3]
+
+
+class bitboard:
+    """
+    64-bit bitboard implementation of threes puzzle
+    the 16 tile indices are packed into one integer, 4 bits per cell,
+    where cell i is stored at bits [4i, 4i + 4)
+    """
+    feature_index = board.feature_index
+    constant_table = board.constant_table
+    feature_cache = None # (raw, weight index) of the last features() call
+    batch_features = staticmethod(board.batch_features)
+
+    def __init__(self, state = None):
+        if state is None:
+            self.raw = 0
+        elif isinstance(state, int):
+            self.raw = state
+        elif isinstance(state, bitboard):
+            self.raw = state.raw
+        else:
+            self.raw = 0
+            for pos, tile in enumerate(state[:]):
+                self.raw |= tile << (pos << 2)
+        return
+
+    def copy(self, target = None):
+        """
+        return a copy of this board
+        or copy this board into an existing board 'target' without allocating a new one
+        """
+        if target is None:
+            target = bitboard.__new__(bitboard)
+        target.raw = self.raw
+        return target
+
+    @property
+    def state(self):
+        raw = self.raw
+        return [(raw >> s) & 0x0f for s in range(0, 64, 4)]
+
+    @state.setter
+    def state(self, state):
+        self.raw = bitboard(state).raw
+        return
+
+    def features(self):
+        if self.feature_cache is not None and self.feature_cache[0] == self.raw:
+            return self.feature_cache[1]
+        state = self.state
+        weight_index = []
+        for feature_index in bitboard.feature_index:
+            index = 0
+            for i in feature_index:
+                index *= 11
+                index += min(state[i], 10)
+            weight_index.append(index)
+        self.feature_cache = self.raw, weight_index
+        return weight_index
+
+    def afterstates(self):
+        """
+        generate the afterstates of all four sliding directions in one pass
+        return a list of (afterstate, reward, legal) indexed by opcode
+
+        the feature indices of an afterstate are computed lazily by its features()
+        """
+        raw, tran = self.raw, transpose(self.raw)
+        right, reward_right = slide_raw(raw, row_right, score_right)
+        left, reward_left = slide_raw(raw, row_left, score_left)
+        up, reward_up = slide_raw(tran, row_left, score_left)
+        down, reward_down = slide_raw(tran, row_right, score_right)
+        up, down = transpose(up), transpose(down)
+        return [(bitboard(up), reward_up, True) if up != raw else (bitboard(raw), -1, False),
+                (bitboard(right), reward_right, True) if right != raw else (bitboard(raw), -1, False),
+                (bitboard(down), reward_down, True) if down != raw else (bitboard(raw), -1, False),
+                (bitboard(left), reward_left, True) if left != raw else (bitboard(raw), -1, False)]
+
+    def __getitem__(self, pos):
+        if isinstance(pos, slice):
+            return self.state[pos]
+        return (self.raw >> (pos << 2)) & 0x0f
+
+    def __setitem__(self, pos, tile):
+        shift = pos << 2
+        self.raw = (self.raw & ~(0x0f << shift)) | (tile << shift)
+        return
+
+    def place(self, pos, tile):
+        """
+        place a tile (index value) to the specific position (1-d form index)
+        return 0 if the action is valid, or -1 if not
+        """
+        if pos >= 16 or pos < 0:
+            return -1
+        if tile != 1 and tile != 2 and tile != 3:
+            return -1
+        self[pos] = tile
+        return 0
+
+    def slide(self, opcode):
+        """
+        apply an action to the board
+        return the reward of the action, or -1 if the action is illegal
+        """
+        if opcode == 0:
+            return self.slide_up()
+        if opcode == 1:
+            return self.slide_right()
+        if opcode == 2:
+            return self.slide_down()
+        if opcode == 3:
+            return self.slide_left()
+        return -1
+
+    def slide_left(self):
+        move, score = slide_raw(self.raw, row_left, score_left)
+        return self._commit(move, score)
+
+    def slide_right(self):
+        move, score = slide_raw(self.raw, row_right, score_right)
+        return self._commit(move, score)
+
+    def slide_up(self):
+        move, score = slide_raw(transpose(self.raw), row_left, score_left)
+        return self._commit(transpose(move), score)
+
+    def slide_down(self):
+        move, score = slide_raw(transpose(self.raw), row_right, score_right)
+        return self._commit(transpose(move), score)
+
+    def _commit(self, move, score):
+        if move != self.raw:
+            self.raw = move
+            return score
+        return -1
+
+    def reflect_horizontal(self):
+        raw = self.raw
+        self.raw = reverse_row(raw & 0xffff) | (reverse_row((raw >> 16) & 0xffff) << 16) | \
+                   (reverse_row((raw >> 32) & 0xffff) << 32) | (reverse_row(raw >> 48) << 48)
+        return
+
+    def reflect_vertical(self):
+        raw = self.raw
+        self.raw = ((raw & 0xffff) << 48) | (((raw >> 16) & 0xffff) << 32) | \
+                   (((raw >> 32) & 0xffff) << 16) | (raw >> 48)
+        return
+
+    def transpose(self):
+        self.raw = transpose(self.raw)
+        return
+
+    def rotate(self, rot = 1):
+        rot = ((rot % 4) + 4) % 4
+        if rot == 1:
+            self.rotate_right()
+            return
+        if rot == 2:
+            self.reverse()
+            return
+        if rot == 3:
+            self.rotate_left()
+            return
+        return
+
+    def rotate_right(self):
+        """ clockwise rotate the board """
+        self.transpose()
+        self.reflect_horizontal()
+        return
+
+    def rotate_left(self):
+        """ counterclockwise rotate the board """
+        self.transpose()
+        self.reflect_vertical()
+        return
+
+    def reverse(self):
+        self.reflect_horizontal()
+        self.reflect_vertical()
+        return
+
+    def __str__(self):
+        state = '+' + '-' * 24 + '+\n'
+        cells = self.state
+        for row in [cells[r:r + 4] for r in range(0, 16, 4)]:
+            state += ('|' + ''.join('{0:6d}'.format(self.constant_table.index2tile(t)) for t in row) + '|\n')
+        state += '+' + '-' * 24 + '+'
+        return state
+
+
+if __name__ == '__main__':
+    print('Threes Demo: bitboard.py\n')
+
+    state = bitboard()
+    state[10] = 10
+    state[11] = 10
+    print(state)
+    print(state.slide(1))
+    print(state)
@@ -9,40 +9,51 @@ Author: Hung Guei (moporgic)
 """
 import numpy as np
 
+def _build_table():
+    """ build the index to tile and index to score tables """
+    index_to_tile = [0, 1, 2, 3]
+    index_to_score = [0, 0, 0, 3]
+    for i in range(11):
+        index_to_tile += [index_to_tile[-1] * 2]
+        index_to_score += [index_to_score[-1] * 3]
+    return tuple(index_to_tile), tuple(index_to_score)
+
+# immutable tables shared by all boards, values are plain ints
+index_to_tile, index_to_score = _build_table()
+
 class Constant:
     """ A constant class to map index to value of tile and score """
-    def __init__(self):
-        
-        self._index_to_tile = np.array([0] * 15)
-        self._index_to_score = np.array([0] * 15)
-        self._build_table()
-        
-    def _build_table(self):
-        
-        self._index_to_tile[:4] = np.arange(4)
-        
-        for i in range(11):
-            self._index_to_tile[i+4] = self._index_to_tile[i+3] * 2
-        
-        self._index_to_score[3] = 3
-        for i in range(11):
-            self._index_to_score[i+4] = self._index_to_score[i+3] * 3
-            
     def index2tile(self, index):
-        return self._index_to_tile[index]
+        return index_to_tile[index]
     
     def index2score(self, index):
-        return self._index_to_score[index]
+        return index_to_score[index]
         
 class board:
     """ simple implementation of 2048 puzzle """
+    constant_table = Constant()
+    feature_cache = None # (state, weight index) of the last features() call
     feature_index = [[0,1,2,3,4,5],[3,7,11,15,2,6],[15,14,13,12,11,10],[3,2,1,0,7,6],[0,4,8,12,1,5],[12,13,14,15,8,9,],[15,11,7,3,14,10],[4,5,6,7,8,9],[2,6,10,14,1,5],[11,10,9,8,7,6],[13,9,5,1,14,10],[7,6,5,4,11,10],[1,5,9,13,2,6],[8,9,10,11,4,5],[14,10,6,2,13,9],[0,1,2,4,5,6],[3,7,11,2,6,10],[15,14,13,11,10,9],[12,8,4,13,9,5],[3,2,1,7,6,5],[0,4,8,1,5,9],[12,13,14,8,9,10],[15,11,7,14,10,6],[4,5,6,8,9,10],[2,6,10,1,5,9],[11,10,9,7,6,5],[13,9,5,14,10,6],[7,6,5,11,10,9],[1,5,9,2,6,10],[8,9,10,4,5,6],[14,10,6,13,9,5]]
     
     def __init__(self, state = None):
         self.state = state[:] if state is not None else [0] * 16
-        self.constant_table = Constant()
         return
+    
+    def copy(self, target = None):
+        """
+        return a copy of this board
+        or copy this board into an existing board 'target' without allocating a new one
+        """
+        if target is None:
+            target = board.__new__(board)
+            target.state = self.state[:]
+            return target
+        target.state[:] = self.state
+        return target
     def features(self):
+        key = tuple(self.state)
+        if self.feature_cache is not None and self.feature_cache[0] == key:
+            return self.feature_cache[1]
         weight_index = []
         for feature_index in board.feature_index:
             index = 0
@@ -50,7 +61,35 @@ class board:
                 index *= 11
                 index += min(self.state[i], 10)
             weight_index.append(index)
+        self.feature_cache = key, weight_index
         return weight_index
+    
+    @staticmethod
+    def batch_features(states):
+        """
+        compute the weight indices of many boards at once
+        'states' is an (N, 16) array of tile indices, return an (N, 31) int array
+        """
+        states = np.minimum(np.asarray(states).reshape(-1, 16), 10)
+        return states[:, board.feature_gather] @ board.feature_power
+    
+    def afterstates(self):
+        """
+        generate the afterstates of all four sliding directions in one pass
+        return a list of (afterstate, reward, legal) indexed by opcode
+        
+        the feature indices of an afterstate are computed lazily by its features()
+        """
+        right, left = self.copy(), self.copy()
+        reward_right, reward_left = right.slide_right(), left.slide_left()
+        up = self.copy()
+        up.transpose()
+        down = up.copy()
+        reward_up, reward_down = up.slide_left(), down.slide_right()
+        up.transpose()
+        down.transpose()
+        return [(up, reward_up, reward_up != -1), (right, reward_right, reward_right != -1),
+                (down, reward_down, reward_down != -1), (left, reward_left, reward_left != -1)]
                 
     def __getitem__(self, pos):
         return self.state[pos]
@@ -96,12 +135,12 @@ class board:
                     buf = buf[1:]
                     buf[0] += 1
                     merge = True
-                    score += self.constant_table.index2score(buf[0])
+                    score += index_to_score[buf[0]]
                     #score += 1
                 elif buf[0] > 0 and buf[1] > 0 and buf[0] + buf[1] == 3:
                     buf = buf[1:]
                     buf[0] = 3
-                    score += self.constant_table.index2score(buf[0])
+                    score += index_to_score[buf[0]]
                     #score += 1
                     merge = True
                 move += [buf[0]]
@@ -182,6 +221,10 @@ class board:
         return state
     
     
+# the cells of each tuple as a gather matrix, and the place value of each cell
+board.feature_gather = np.array(board.feature_index)
+board.feature_power = 11 ** np.arange(len(board.feature_index[0]) - 1, -1, -1)
+
 if __name__ == '__main__':
     print('Threes Demo: board.py\n')
     
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+"""
+Background checkpoints of training, and exact resume from them
+"""
+
+from weight import save_header, load_header, save_delta, load_delta
+from array import array
+import threading
+import io
+import os
+
+
+# a checkpoint is a weight file whose header also holds the training state, so load= can read it as well
+# the random streams are those of the agents and of the tile bag, training draws nothing from the global generators
+
+def snapshot(play, evil, stat, delta = None):
+    """
+    a consistent copy of the training state between two episodes: the header and copies of the tables
+    the statistic keeps only the episodes of the current block, so the next block shows the same numbers
+
+    if 'delta' is (base, sequence), only the entries changed since the last snapshot are copied,
+    as the (indices, values) of each table
+    """
+    partial = stat.count % stat.block
+    episodes = list(stat.data)[len(stat.data) - partial:] if partial else []
+    state = {
+        "count": stat.count,
+        "epsilon": play.epsilon,
+        "alpha": play.alpha,
+        "version": play.version,
+        "play": play.rng.getstate(),
+        "evil": evil.rng.getstate(),
+        "bag": list(evil.bag.tile_bag),
+        "bag_rng": evil.bag.rng.getstate(),
+        "episodes": "".join(str(ep) + "\n" for ep in episodes),
+    }
+    header = {"layout": play.layout.config(), "checkpoint": state}
+    if play.coherence:
+        header["coherence"] = True # E and A are saved with the tables
+    if delta is not None:
+        header["delta"] = {"base": delta[0], "sequence": delta[1]}
+        return header, [w.changes() for w in play.net]
+    for w in play.net:
+        if w.touched is not None:
+            w.touched[:] = False
+    return header, [[value.copy() for value in w.arrays()] for w in play.net]
+
+
+def write(path, header, tables):
+    """ write a snapshot to a temporary file, then rename it over 'path', so 'path' is always complete """
+    temp = path + ".tmp"
+    with open(temp, 'wb') as output:
+        save_header(output, header)
+        array('I', [len(tables)]).tofile(output)
+        for arrays in tables:
+            for value in arrays:
+                array('Q', [len(value)]).tofile(output)
+                value.tofile(output)
+        output.flush()
+        os.fsync(output.fileno())
+    os.replace(temp, path)
+    return
+
+
+def write_delta(path, header, changes):
+    """ write a delta checkpoint atomically, like write() """
+    temp = path + ".tmp"
+    with open(temp, 'wb') as output:
+        save_delta(output, header, changes)
+        output.flush()
+        os.fsync(output.fileno())
+    os.replace(temp, path)
+    return
+
+
+def deltas(path):
+    """ the paths of the delta checkpoints of the base checkpoint 'path', in order """
+    result = []
+    while os.path.exists("%s.%d" % (path, len(result) + 1)):
+        result += ["%s.%d" % (path, len(result) + 1)]
+    return result
+
+
+def load_chain(path, play):
+    """
+    load the tables of a full checkpoint into 'play', then apply its delta checkpoints 'path'.1, 'path'.2, ... in order
+    return the training state of the last checkpoint applied
+    """
+    play.net = []
+    play.load_weight(path) # also reads the layout from the header
+    play.link_tables()
+    with open(path, 'rb') as input:
+        state = load_header(input)["checkpoint"]
+    base = state["count"]
+    for sequence, name in enumerate(deltas(path), 1):
+        with open(name, 'rb') as input:
+            header = load_header(input)
+            if header is None or header.get("delta") != {"base": base, "sequence": sequence}:
+                break # left over from an older base
+            input.seek(0)
+            state = load_delta(input, play.net)["checkpoint"]
+    return state
+
+
+def restore(path, play, evil, stat):
+    """ load the tables and the training state of a checkpoint chain into the agents and the statistic """
+    state = load_chain(path, play)
+    play.epsilon, play.alpha, play.version = state["epsilon"], state["alpha"], state["version"]
+    play.rng.setstate(state["play"])
+    evil.rng.setstate(state["evil"])
+    evil.bag.tile_bag = list(state["bag"])
+    evil.bag.rng.setstate(state["bag_rng"])
+    stat.load(io.StringIO(state["episodes"]))
+    stat.count = state["count"]
+    return state["count"]
+
+
+class checkpointer:
+    """
+    take a snapshot every 'every' episodes and write it in a background thread
+    playing only waits for the copy of the tables, or for the previous write if it is still running
+
+    with 'deltas' > 0, a full checkpoint is followed by up to 'deltas' delta checkpoints 'path'.1, 'path'.2, ...
+    that hold only the entries changed since the previous checkpoint
+    """
+
+    def __init__(self, path, every, deltas = 0):
+        self.path = path
+        self.every = every
+        self.deltas = deltas
+        self.base, self.sequence = None, 0 # the episode counter of the last full checkpoint, the deltas since it
+        self.thread = None
+        self.written = 0
+        return
+
+    def step(self, play, evil, stat):
+        """ called after each episode, take a snapshot if the episode counter is at a checkpoint """
+        if self.every and stat.count % self.every == 0:
+            self.save(play, evil, stat)
+        return
+
+    def save(self, play, evil, stat):
+        if self.deltas and self.base is not None and self.sequence < self.deltas:
+            self.sequence += 1
+            header, changes = snapshot(play, evil, stat, (self.base, self.sequence))
+            self.wait()
+            self.thread = threading.Thread(target = self.run_delta, args = (header, changes), daemon = True)
+        else:
+            self.base, self.sequence = stat.count, 0
+            for w in play.net:
+                if self.deltas and w.touched is None:
+                    w.track()
+            header, tables = snapshot(play, evil, stat)
+            self.wait()
+            self.thread = threading.Thread(target = self.run, args = (header, tables), daemon = True)
+        self.thread.start()
+        return
+
+    def run(self, header, tables):
+        write(self.path, header, tables)
+        for name in deltas(self.path): # the deltas of the previous base
+            os.remove(name)
+        self.written += 1
+        return
+
+    def run_delta(self, header, changes):
+        write_delta("%s.%d" % (self.path, header["delta"]["sequence"]), header, changes)
+        self.written += 1
+        return
+
+    def wait(self):
+        """ wait for the running write to finish """
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        return
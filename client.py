@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+"""
+Client and load generator of the move server
+"""
+
+from benchmark import corpus
+from board import board
+import asyncio
+import json
+import time
+import sys
+import numpy as np
+
+
+async def connect(path, port):
+    if path:
+        return await asyncio.open_unix_connection(path)
+    return await asyncio.open_connection("127.0.0.1", port)
+
+
+async def session(path, port, boards, window, latency, answers):
+    """ send the boards over one connection, with up to 'window' requests in flight """
+    reader, writer = await connect(path, port)
+    ticks = []
+    received = 0
+    for i, state in enumerate(boards):
+        writer.write((" ".join(str(tile) for tile in state) + "\n").encode())
+        await writer.drain()
+        ticks.append(time.perf_counter())
+        if i + 1 - received >= window:
+            answers.append(await reader.readline())
+            latency.append(time.perf_counter() - ticks[received])
+            received += 1
+    while received < len(boards):
+        answers.append(await reader.readline())
+        latency.append(time.perf_counter() - ticks[received])
+        received += 1
+    writer.close()
+    return
+
+
+async def stats(path, port):
+    reader, writer = await connect(path, port)
+    writer.write(b"stats\n")
+    line = await reader.readline()
+    writer.close()
+    return json.loads(line)
+
+
+async def generate(path, port, states, clients, requests, window):
+    """ run 'clients' connections, each sending 'requests' boards, return the latencies and the answers of each client """
+    latency = [[] for i in range(clients)]
+    answers = [[] for i in range(clients)]
+    jobs = []
+    for c in range(clients):
+        boards = [states[(c * requests + i) % len(states)] for i in range(requests)]
+        jobs += [session(path, port, boards, window, latency[c], answers[c])]
+    await asyncio.gather(*jobs)
+    return latency, answers
+
+
+def check(play_args, states, clients, requests, answers):
+    """ compare the answers with the moves and values of a local weight_agent, return the number of mismatches """
+    from agent import weight_agent
+    play = weight_agent(play_args)
+    wrong = 0
+    for c in range(clients):
+        for i, line in enumerate(answers[c]):
+            state = board(states[(c * requests + i) % len(states)])
+            best, best_value = -1, 0.0
+            for op, (after, reward, legal) in enumerate(state.afterstates()):
+                if legal:
+                    value = play.value(after) + reward
+                    if best == -1 or value > best_value:
+                        best, best_value = op, value
+            op, value = line.decode().split()
+            if int(op) != best or float(value) != best_value:
+                wrong += 1
+    return wrong
+
+
+if __name__ == '__main__':
+    print('Threes Demo: ' + " ".join(sys.argv))
+    print()
+
+    path, port = "", 0
+    clients, requests, window = 8, 1000, 1
+    games, seed = 50, 1
+    play_args = ""
+    for para in sys.argv[1:]:
+        if "--socket=" in para:
+            path = para[(para.index("=") + 1):]
+        elif "--port=" in para:
+            port = int(para[(para.index("=") + 1):])
+        elif "--clients=" in para:
+            clients = int(para[(para.index("=") + 1):])
+        elif "--requests=" in para:
+            requests = int(para[(para.index("=") + 1):])
+        elif "--window=" in para:
+            window = int(para[(para.index("=") + 1):])
+        elif "--seed=" in para:
+            seed = int(para[(para.index("=") + 1):])
+        elif "--check=" in para:
+            play_args = para[(para.index("=") + 1):]
+    if not path and not port:
+        port = 7777
+
+    states = corpus(games, seed)
+    tick = time.perf_counter()
+    latency, answers = asyncio.run(generate(path, port, states, clients, requests, window))
+    elapsed = time.perf_counter() - tick
+    latency = np.concatenate([np.array(l) for l in latency]) * 1000
+    print("%d clients x %d requests (window %d) in %.2f sec, %.1f requests/sec" % (
+          clients, requests, window, elapsed, clients * requests / elapsed))
+    print("client latency p50 = %.3f ms, p90 = %.3f ms, p99 = %.3f ms, max = %.3f ms" % (
+          np.percentile(latency, 50), np.percentile(latency, 90), np.percentile(latency, 99), latency.max()))
+    print("server", asyncio.run(stats(path, port)))
+    if play_args:
+        print(check(play_args, states, clients, requests, answers), "answers differ from the local agent")
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+
+"""
+Convert weight files to the mapped format, and compare loading both formats
+"""
+
+from agent import weight_agent
+from quantize import resident
+import contextlib
+import time
+import sys
+import io
+import os
+import numpy as np
+
+
+def convert(source, target):
+    """ save the tables of a weight file (of any format) as a mapped weight file 'target' """
+    with contextlib.redirect_stdout(io.StringIO()):
+        play = weight_agent("name=td_learning load=" + source)
+    play.save_mapped(target)
+    return
+
+
+def open_tables(path):
+    """ load a weight file in test mode, return the agent, the load time and the memory it took """
+    before = resident()
+    tick = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        play = weight_agent("name=td_learning load=" + path)
+    return play, time.perf_counter() - tick, resident() - before
+
+
+if __name__ == '__main__':
+    print('Threes Demo: convert.py\n')
+
+    if len(sys.argv) == 3:
+        convert(sys.argv[1], sys.argv[2])
+        print("%s (%.1f MB) -> %s (%.1f MB)" % (sys.argv[1], os.path.getsize(sys.argv[1]) / (1 << 20),
+                                              sys.argv[2], os.path.getsize(sys.argv[2]) / (1 << 20)))
+    elif len(sys.argv) == 4 and sys.argv[1] == "compare":
+        base, base_time, base_memory = open_tables(sys.argv[2])
+        print("%s: load %.3f sec, %.1f MB" % (sys.argv[2], base_time, base_memory))
+        play, load_time, memory = open_tables(sys.argv[3])
+        print("%s: load %.3f sec, %.1f MB" % (sys.argv[3], load_time, memory))
+        same = all(np.array_equal(a.value, b.value) and a.scale == b.scale for a, b in zip(base.net, play.net))
+        print("the tables are", "the same" if same and len(base.net) == len(play.net) else "different")
+    else:
+        print("usage: convert.py <weight> <output> | convert.py compare <weight> <mapped>")
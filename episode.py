@@ -55,6 +55,32 @@ class episode:
     def last_turns(self, play, evil):
         agent = self.take_turns(evil, play)
         return agent
+    
+    def play(self, play, evil):
+        """
+        play this episode between the player 'play' and the environment 'evil' until it is over
+        return the cells of each afterstate of the player, and the rewards between them
+        """
+        afterstates, rewards = [], []
+        player_lastslide = -1
+        while True:
+            who = self.take_turns(play, evil)
+            if who.info['role'] == "player":
+                move, slide_direction = who.take_action(self.state())
+                player_lastslide = slide_direction
+            else:
+                move = who.take_action(self.state(), player_lastslide)
+            
+            legal_action ,reward = self.apply_action(move)
+            if who.info['role'] == 'player':
+                if afterstates:
+                    rewards.append(reward)
+                afterstates.append(self.state().state[:])
+            
+            if not legal_action or who.check_for_win(self.state()):
+                break
+        return afterstates, rewards
+    
     def step(self, who = -1):
         size = len(self.ep_moves)
         if who == action.slide.type:
@@ -84,8 +110,58 @@ class episode:
         output.write(self.__str__())
         return True
     
-    def load(self, input):
+    def load(self, input, replay = True):
         """ deserialize from a file object """
+        return self.parse(input.readline(), replay)
+    
+    def parse(self, line, replay = True):
+        """
+        deserialize from a line of text in one pass, the same as load_reference() but much faster
+        if 'replay' is False, the moves are not applied to the board, so the state stays empty
+        and the score is the sum of the rewards
+        """
+        try:
+            self.clear()
+            # line --> open|moves|close
+            delim = line.index("|"), line.index("|", line.index("|") + 1)
+            open = line[0:delim[0]]
+            close = line[(delim[1] + 1):]
+            # open --> flag@time
+            delim_open = open.index("@")
+            self.ep_open = open[0:delim_open], int(open[(delim_open + 1):])
+            # close --> flag@time
+            delim_close = close.index("@")
+            self.ep_close = close[0:delim_close], int(close[(delim_close + 1):])
+            # moves --> action[reward](time)...
+            moves, i, end = line, delim[0] + 1, delim[1]
+            state, score, records = self.ep_state, 0, []
+            while i < end:
+                # ?? --> action, an unknown code is skipped as an invalid action
+                code = moves[i:i + 2] if i + 2 <= end else moves[i:end]
+                if len(code) < 2:
+                    return False
+                a = episode.codes.get(code)
+                if a is None:
+                    a = action()
+                i += 2
+                # [?] --> reward, (?) --> time
+                r, t = 0, 0
+                if i < end and moves[i] == "[":
+                    close_at = moves.index("]", i + 1, end)
+                    r, i = int(moves[i + 1:close_at]), close_at + 1
+                if i < end and moves[i] == "(":
+                    close_at = moves.index(")", i + 1, end)
+                    t, i = int(moves[i + 1:close_at]), close_at + 1
+                score += a.apply(state) if replay else r
+                records.append((a, r, t))
+            self.ep_score, self.ep_moves = score, records
+            return True
+        except (RuntimeError, ValueError, IndexError):
+            pass
+        return False
+    
+    def load_reference(self, input):
+        """ deserialize from a file object character by character, the original parser kept as the reference of parse() """
         try:
             self.clear()
             line = input.readline()
@@ -151,13 +227,65 @@ class episode:
         return
     
     def initial_state(self):
-        return board()
+        return episode.board()
     
     def millisec(self):
         return int(round(time.time() * 1000))
         
     def store_state(self, state):
         self.store_state.append()
+
+episode.board = board # the board implementation of new episodes, e.g. bitboard
+
+# the text code of each valid action, shared by the episodes loaded by parse()
+episode.codes = {str(action.slide(op)): action.slide(op) for op in range(4)}
+episode.codes.update({str(action.place(pos, tile)): action.place(pos, tile) for pos in range(16) for tile in range(1, 36)})
+
+
+def episodes(input, replay = True):
+    """ stream the episodes of a file object, one per line, until a line cannot be parsed """
+    for line in input:
+        ep = episode()
+        if not ep.parse(line, replay):
+            return
+        yield ep
+    return
+
+
+class outcome:
+    """ the result of an episode played elsewhere, e.g. by an actor process """
+    
+    def __init__(self, score, state, steps, times, text = ""):
+        self.ep_score = score
+        self.ep_state = board(state)
+        self.ep_steps = steps # all, player, environment
+        self.ep_times = times # all, player, environment
+        self.text = text
+        return
+    
+    def state(self):
+        return self.ep_state
+    
+    def score(self):
+        return self.ep_score
+    
+    def step(self, who = -1):
+        if who == action.slide.type:
+            return self.ep_steps[1]
+        if who == action.place.type:
+            return self.ep_steps[2]
+        return self.ep_steps[0]
+    
+    def time(self, who = -1):
+        if who == action.slide.type:
+            return self.ep_times[1]
+        if who == action.place.type:
+            return self.ep_times[2]
+        return self.ep_times[0]
+    
+    def __str__(self):
+        return self.text
+
 if __name__ == '__main__':
     print('2048 Demo: episode.py\n')
     # action, reward, time usage
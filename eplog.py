@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+
+"""
+Compact binary append-only episode log, and its mmap reader
+"""
+
+from action import action
+from episode import episode, episodes
+import mmap
+import os
+import sys
+import struct
+
+# the file starts with a 16-byte header: magic 'TEPL', version (uint32), flags (uint32), reserved (uint32)
+# flag 0x1 means the records carry the time usage of each move
+#
+# each episode is a record: body length (uint32) followed by the body
+#     open flag (varint length + utf-8), open time (varint)
+#     close flag (varint length + utf-8), close time (varint)
+#     number of moves (varint)
+#     moves, one byte each: 0x00-0x03 slide opcode, 0x80 | tile << 4 | pos a place of tile 1-7,
+#         0x40 | pos followed by a tile byte for larger tiles, 0x3f an unknown action
+#     rewards (varint each)
+#     time usages (varint each, only with flag 0x1)
+
+magic = b'TEPL'
+version = 1
+timings = 0x1
+header = struct.Struct('<4sIII')
+length = struct.Struct('<I')
+
+
+def put_varint(buf, value):
+    value = int(value)
+    if value < 0:
+        raise ValueError("%d cannot be stored in an episode log, the values are unsigned" % value)
+    while value >= 0x80:
+        buf.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buf.append(value)
+    return
+
+
+def get_varint(data, pos):
+    value, shift = 0, 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def encode(ep, flags = timings):
+    """ the record body of an episode """
+    buf = bytearray()
+    for flag, tick in [ep.ep_open, ep.ep_close]:
+        flag = str(flag).encode()
+        put_varint(buf, len(flag))
+        buf += flag
+        put_varint(buf, tick)
+    put_varint(buf, len(ep.ep_moves))
+    for move, reward, usage in ep.ep_moves:
+        kind, event = move.code & 0xff000000, move.code & 0x00ffffff # the subclasses shadow type() with their type code
+        if kind == action.slide.type and event < 4:
+            buf.append(event)
+        elif kind == action.place.type and 0 < (event >> 4) < 8:
+            buf.append(0x80 | ((event >> 4) << 4) | (event & 0x0f))
+        elif kind == action.place.type:
+            buf += bytes([0x40 | (event & 0x0f), (event >> 4) & 0xff])
+        else:
+            buf.append(0x3f)
+    for move, reward, usage in ep.ep_moves:
+        put_varint(buf, reward)
+    if flags & timings:
+        for move, reward, usage in ep.ep_moves:
+            put_varint(buf, usage)
+    return bytes(buf)
+
+
+def decode(data, pos, end, flags, replay = True):
+    """ the episode of the record body data[pos:end], replay the moves on the board if 'replay' """
+    ep = episode()
+    marks = []
+    for i in range(2):
+        size, pos = get_varint(data, pos)
+        flag = bytes(data[pos:pos + size]).decode()
+        tick, pos = get_varint(data, pos + size)
+        marks += [(flag, tick)]
+    ep.ep_open, ep.ep_close = marks
+    count, pos = get_varint(data, pos)
+    moves = []
+    for i in range(count):
+        code = data[pos]
+        pos += 1
+        if code < 4:
+            moves += [action.slide(code)]
+        elif code & 0x80:
+            moves += [action.place(code & 0x0f, (code >> 4) & 0x07)]
+        elif code & 0x40 and code != 0x3f:
+            moves += [action.place(code & 0x0f, data[pos])]
+            pos += 1
+        else:
+            moves += [action()]
+    rewards = []
+    for i in range(count):
+        reward, pos = get_varint(data, pos)
+        rewards += [reward]
+    usages = [0] * count
+    if flags & timings:
+        for i in range(count):
+            usages[i], pos = get_varint(data, pos)
+    if pos != end:
+        raise ValueError("corrupted episode record")
+    ep.ep_moves = list(zip(moves, rewards, usages))
+    if replay:
+        for move in moves:
+            ep.ep_score += move.apply(ep.ep_state)
+    else:
+        ep.ep_score = sum(rewards)
+    return ep
+
+
+class writer:
+    """
+    append episodes to a log file, the file is created with a header if it does not exist
+    an incomplete record at the end of an existing file (e.g. after a crash) is truncated before appending
+    """
+
+    def __init__(self, path, flags = timings):
+        exists = os.path.exists(path) and os.path.getsize(path) >= header.size
+        if exists:
+            log = reader(path, replay = False)
+            self.flags = log.flags
+            end = header.size
+            for start, end in log.records():
+                pass
+            log.close()
+            self.output = open(path, 'r+b')
+            self.output.truncate(end)
+            self.output.seek(end)
+        else:
+            self.output = open(path, 'wb')
+            self.flags = flags
+            self.output.write(header.pack(magic, version, flags, 0))
+            self.output.flush()
+        return
+
+    def append(self, ep):
+        """ append an episode and flush it, so a crash loses at most the record being written """
+        body = encode(ep, self.flags)
+        self.output.write(length.pack(len(body)) + body)
+        self.output.flush()
+        return True
+
+    def close(self):
+        self.output.close()
+        return
+
+
+class reader:
+    """
+    read the episodes of a log file through mmap
+    iterating decodes the records lazily, and indexing uses an offset table built on the first random access
+    an incomplete record at the end of the file (e.g. after a crash) is ignored
+    """
+
+    def __init__(self, path, replay = True):
+        self.replay = replay
+        self.input = open(path, 'rb')
+        size = os.fstat(self.input.fileno()).st_size
+        self.data = mmap.mmap(self.input.fileno(), 0, access = mmap.ACCESS_READ) if size else b''
+        if size < header.size:
+            raise ValueError("%s is not an episode log" % path)
+        tag, ver, self.flags, reserved = header.unpack_from(self.data, 0)
+        if tag != magic or ver != version:
+            raise ValueError("%s is not an episode log of version %d" % (path, version))
+        self.offset = None
+        return
+
+    def records(self):
+        """ the (start, end) of the body of each complete record """
+        pos, size = header.size, len(self.data)
+        while pos + length.size <= size:
+            body, = length.unpack_from(self.data, pos)
+            if pos + length.size + body > size:
+                break
+            yield pos + length.size, pos + length.size + body
+            pos += length.size + body
+        return
+
+    def __iter__(self):
+        for start, end in self.records():
+            yield decode(self.data, start, end, self.flags, self.replay)
+        return
+
+    def index(self):
+        if self.offset is None:
+            self.offset = list(self.records())
+        return self.offset
+
+    def __len__(self):
+        return len(self.index())
+
+    def __getitem__(self, i):
+        start, end = self.index()[i]
+        return decode(self.data, start, end, self.flags, self.replay)
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.input.close()
+        return
+
+
+def from_text(input, path, flags = timings):
+    """ convert the text episodes of a file object into a log file, return the number of episodes """
+    log = writer(path, flags)
+    count = 0
+    for ep in episodes(input, replay = False):
+        log.append(ep)
+        count += 1
+    log.close()
+    return count
+
+
+def to_text(path, output):
+    """ convert a log file into text episodes written to a file object, return the number of episodes """
+    log = reader(path, replay = False)
+    count = 0
+    for ep in log:
+        output.write(str(ep) + "\n")
+        count += 1
+    log.close()
+    return count
+
+
+if __name__ == '__main__':
+    print('Threes Demo: eplog.py\n')
+
+    if len(sys.argv) == 4 and sys.argv[1] in ["totext", "fromtext"]:
+        if sys.argv[1] == "totext":
+            with open(sys.argv[3], "w") as output:
+                print(to_text(sys.argv[2], output), "episodes")
+        else:
+            with open(sys.argv[2], "r") as input:
+                print(from_text(input, sys.argv[3]), "episodes")
+    else:
+        print("usage: eplog.py totext <log> <text> | eplog.py fromtext <text> <log>")
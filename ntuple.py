@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+"""
+Configurable n-tuple network layout with symmetry weight sharing
+"""
+
+from board import board
+import numpy as np
+import json
+
+
+def _build_isomorphism():
+    """
+    the 8 isomorphisms of the board as cell mappings, isomorphism[k][c] is where cell c goes
+    k = 0..3 rotate the board k times clockwise, k = 4..7 reflect it horizontally first
+    """
+    isomorphism = []
+    for k in range(8):
+        state = board(list(range(16)))
+        if k >= 4:
+            state.reflect_horizontal()
+        state.rotate(k % 4)
+        isomorphism += [tuple(state.state.index(c) for c in range(16))]
+    return tuple(isomorphism)
+
+isomorphism = _build_isomorphism()
+
+
+class layout:
+    """
+    the layout of an n-tuple network
+    each base pattern is expanded by the isomorphisms, and all the expanded tuples of a pattern share one table
+    features() returns one weight index per expanded tuple, and table[i] is the table read by tuple i
+    """
+
+    def __init__(self, patterns, isomorphisms = (0,), name = "custom"):
+        self.name = name
+        self.patterns = [list(p) for p in patterns]
+        self.isomorphisms = list(isomorphisms)
+        self.tuples, self.table = [], []
+        for t, pattern in enumerate(self.patterns):
+            expanded = []
+            for k in self.isomorphisms:
+                cells = [isomorphism[k][c] for c in pattern]
+                if cells not in expanded:
+                    expanded += [cells]
+            self.tuples += expanded
+            self.table += [t] * len(expanded)
+        self.size = [11 ** len(p) for p in self.patterns]
+        self.symmetric = sorted(set(self.isomorphisms)) == list(range(8))
+
+        # precomputed index tables, tuples shorter than the longest one are padded with cells of place value 0
+        width = max(len(cells) for cells in self.tuples)
+        self.gather = np.zeros((len(self.tuples), width), dtype = np.int64)
+        self.power = np.zeros((len(self.tuples), width), dtype = np.int64)
+        for i, cells in enumerate(self.tuples):
+            self.gather[i, :len(cells)] = cells
+            self.power[i, :len(cells)] = 11 ** np.arange(len(cells) - 1, -1, -1)
+        return
+
+    def features(self, state):
+        """ the weight index of each tuple of a board """
+        if self.name == "legacy":
+            return state.features()
+        cells = state.state
+        weight_index = []
+        for tuple_index in self.tuples:
+            index = 0
+            for i in tuple_index:
+                index *= 11
+                index += min(cells[i], 10)
+            weight_index.append(index)
+        return weight_index
+
+    def batch_features(self, states):
+        """ the weight indices of an (N, 16) array of boards, return an (N, tuples) int array """
+        states = np.minimum(np.asarray(states).reshape(-1, 16), 10)
+        return (states[:, self.gather] * self.power).sum(axis = 2)
+
+    def config(self):
+        return {"name": self.name, "patterns": self.patterns, "isomorphisms": self.isomorphisms}
+
+    def __len__(self):
+        return len(self.tuples)
+
+
+def legacy():
+    """ the 31 hardcoded tuples of board.feature_index, each one with its own table """
+    return layout(board.feature_index, (0,), "legacy")
+
+
+def from_config(config):
+    """ build a layout from a dict with 'patterns' and optionally 'isomorphisms' (default all 8) and 'name' """
+    return layout(config["patterns"], config.get("isomorphisms", range(8)), config.get("name", "custom"))
+
+
+def load(path = None):
+    """ load a layout from a JSON file, or the legacy layout if 'path' is None or 'legacy' """
+    if path is None or path == "legacy":
+        return legacy()
+    with open(path, "r") as input:
+        return from_config(json.load(input))
+
+
+if __name__ == '__main__':
+    print('Threes Demo: ntuple.py\n')
+
+    net = load("tuples.json")
+    print(net.patterns)
+    print(len(net), "tuples in", len(net.patterns), "tables, symmetric =", net.symmetric)
+    state = board([1, 2, 3, 0] * 4)
+    print(net.features(state))
+    print(net.batch_features([state.state]))
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+
+"""
+Parallel self-play training with actor processes and one learner, and parallel evaluation with forked workers
+"""
+
+from action import action
+from episode import episode, outcome
+from agent import weight_agent, rndenv
+from statistic import statistic
+from weight import weight
+import ntuple
+from multiprocessing import shared_memory
+import multiprocessing
+import numpy as np
+import time
+
+
+class ring:
+    """
+    single-producer single-consumer byte ring buffer in shared memory
+    the first 16 bytes hold the write and read counters, the rest is data,
+    each record is a uint64 length followed by the payload
+    """
+
+    def __init__(self, size = 1 << 22, name = None):
+        self.size = size
+        self.shm = shared_memory.SharedMemory(name = name, create = name is None, size = size + 16)
+        self.counter = np.ndarray(2, dtype = np.uint64, buffer = self.shm.buf) # written, read
+        self.data = np.ndarray(size, dtype = np.uint8, buffer = self.shm.buf, offset = 16)
+        return
+
+    def name(self):
+        return self.shm.name
+
+    def put(self, payload, stop = None):
+        """ append a record, wait while the buffer is full, return False if 'stop' is set meanwhile """
+        need = 8 + len(payload)
+        if need > self.size:
+            raise ValueError("record of %d bytes exceeds the ring size %d" % (need, self.size))
+        head = int(self.counter[0])
+        while self.size - (head - int(self.counter[1])) < need:
+            if stop is not None and stop.is_set():
+                return False
+            time.sleep(0.001)
+        self._write(head, np.array([len(payload)], dtype = np.uint64).tobytes())
+        self._write(head + 8, payload)
+        self.counter[0] = head + need
+        return True
+
+    def get(self):
+        """ pop the oldest record, or return None if the buffer is empty """
+        tail = int(self.counter[1])
+        if tail == int(self.counter[0]):
+            return None
+        length = int(np.frombuffer(self._read(tail, 8), dtype = np.uint64)[0])
+        payload = self._read(tail + 8, length)
+        self.counter[1] = tail + 8 + length
+        return payload
+
+    def _write(self, pos, payload):
+        pos %= self.size
+        first = min(len(payload), self.size - pos)
+        buf = np.frombuffer(payload, dtype = np.uint8)
+        self.data[pos:pos + first] = buf[:first]
+        self.data[:len(buf) - first] = buf[first:]
+        return
+
+    def _read(self, pos, length):
+        pos %= self.size
+        first = min(length, self.size - pos)
+        return self.data[pos:pos + first].tobytes() + self.data[:length - first].tobytes()
+
+    def close(self, unlink = False):
+        del self.counter, self.data
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+        return
+
+
+class tables:
+    """
+    the published weight tables in shared memory, guarded by a version counter (a seqlock)
+    the version is odd while the learner is writing, and even once the tables are consistent;
+    actors never play on the shared block, they copy it into private tables with refresh()
+    """
+
+    def __init__(self, sizes, name = None):
+        self.sizes = sizes
+        self.shm = shared_memory.SharedMemory(name = name, create = name is None, size = 8 + 4 * max(sum(sizes), 1))
+        self.version = np.ndarray(1, dtype = np.uint64, buffer = self.shm.buf)
+        self.value, offset = [], 8
+        for size in sizes:
+            self.value += [np.ndarray(size, dtype = np.float32, buffer = self.shm.buf, offset = offset)]
+            offset += 4 * size
+        return
+
+    def name(self):
+        return self.shm.name
+
+    def publish(self, net):
+        """ copy the weights of the learner into the shared tables """
+        self.version[0] += 1
+        for value, w in zip(self.value, net):
+            value[:] = w.value
+        self.version[0] += 1
+        return
+
+    def refresh(self, net, seen = None, stop = None):
+        """
+        copy the shared tables into the private tables of 'net' if a version newer than 'seen' is published
+        a copy is kept only if the version was even before it and unchanged after it, otherwise it is retried
+        return the version copied, or 'seen' if it is still the latest (or if 'stop' is set while waiting)
+        """
+        while stop is None or not stop.is_set():
+            version = int(self.version[0])
+            if version == seen:
+                break
+            if version % 2:
+                time.sleep(0.0001) # the learner is publishing
+                continue
+            for value, w in zip(self.value, net):
+                w.value[:] = value
+            if int(self.version[0]) == version:
+                return version
+        return seen
+
+    def close(self, unlink = False):
+        del self.version, self.value
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+        return
+
+
+def reseed(options, rank):
+    """
+    the options of an agent in an actor process
+    give the agent the random streams of index 'rank' spawned from its 'seed=', and drop the options about weight files
+    """
+    args = []
+    for option in options.split():
+        if option.split("=")[0] not in ["init", "load", "save", "stream"]:
+            args += [option]
+    return " ".join(args + ["stream=%d" % rank])
+
+
+def pack(game, features, rewards, text):
+    """ serialize the trajectory and the statistic of a finished episode into bytes """
+    text = str(game).encode() if text else b""
+    steps = game.step(), game.step(action.slide.type), game.step(action.place.type)
+    times = game.time(), game.time(action.slide.type), game.time(action.place.type)
+    header = [len(features), features.shape[1], game.score()] + list(steps) + list(times) + [len(text)]
+    return np.array(header + game.state().state[:], dtype = np.int64).tobytes() + \
+           features.astype(np.int32).tobytes() + np.array(rewards, dtype = np.int32).tobytes() + text
+
+
+def unpack(payload):
+    """ deserialize a record from pack(), return the features, the rewards, and the outcome """
+    header = np.frombuffer(payload, dtype = np.int64, count = 26)
+    size, width, score = int(header[0]), int(header[1]), int(header[2])
+    steps, times, length = header[3:6].tolist(), header[6:9].tolist(), int(header[9])
+    offset = 26 * 8
+    features = np.frombuffer(payload, dtype = np.int32, count = size * width, offset = offset).reshape(size, width)
+    offset += 4 * size * width
+    rewards = np.frombuffer(payload, dtype = np.int32, count = max(size - 1, 0), offset = offset)
+    offset += 4 * max(size - 1, 0)
+    text = payload[offset:offset + length].decode()
+    return features, rewards, outcome(score, header[10:26].tolist(), steps, times, text)
+
+
+def actor(rank, play_args, evil_args, config, table_name, sizes, ring_name, ring_size, stop, text):
+    """ the main loop of an actor process: play episodes with the shared tables, stream them to the learner """
+    shared = tables(sizes, table_name)
+    channel = ring(ring_size, ring_name)
+    play = weight_agent(reseed(play_args, rank) + " init=0")
+    play.test = True
+    play.layout = ntuple.from_config(config)
+    play.net = [weight(size) for size in sizes]
+    play.link_tables()
+    seen = shared.refresh(play.net, None, stop)
+    evil = rndenv(reseed(evil_args, rank))
+    while not stop.is_set():
+        seen = shared.refresh(play.net, seen, stop)
+        play.open_episode("~:" + evil.name())
+        evil.open_episode(play.name() + ":~")
+        game = episode()
+        game.open_episode(play.name() + ":" + evil.name())
+        afterstates, rewards = game.play(play, evil)
+        win = game.last_turns(play, evil)
+        game.close_episode(win.name())
+        play.close_episode(win.name())
+        evil.close_episode(win.name())
+        if not game.ep_moves:
+            continue
+        features = play.layout.batch_features(afterstates)
+        if not channel.put(pack(game, features, rewards, text), stop):
+            break
+    del play
+    channel.close()
+    shared.close()
+    return
+
+
+def train(stat, play, play_args, evil_args, actors, sync = 100, text = False, ring_size = 1 << 22):
+    """
+    train 'play' with 'actors' self-play processes until 'stat' is finished
+    the learner applies update_weight for every episode it receives,
+    and publishes its weights to the actors every 'sync' episodes
+    """
+    shared = tables([len(w) for w in play.net])
+    shared.publish(play.net)
+    rings = [ring(ring_size) for i in range(actors)]
+    stop = multiprocessing.Event()
+    procs = [multiprocessing.Process(target = actor, args = (rank, play_args, evil_args, play.layout.config(), shared.name(),
+                                     shared.sizes, rings[rank].name(), ring_size, stop, text))
+             for rank in range(actors)]
+    for proc in procs:
+        proc.start()
+
+    count = [0] * actors
+    start = block_start = checked = time.time()
+    published = 0
+    try:
+        while not stat.is_finished():
+            if time.time() - checked > 0.1: # an actor only exits early if it failed or was killed
+                for rank, proc in enumerate(procs):
+                    if proc.exitcode is not None:
+                        raise RuntimeError("actor %d exited early with code %d" % (rank, proc.exitcode))
+                checked = time.time()
+            idle = True
+            for rank, channel in enumerate(rings):
+                payload = channel.get()
+                if payload is None:
+                    continue
+                idle = False
+                features, rewards, result = unpack(payload)
+                count[rank] += 1
+                play.update_weight(features[:-1], rewards, features[1:])
+                stat.append(result)
+                if stat.count - published >= sync:
+                    shared.publish(play.net)
+                    published = stat.count
+                if stat.count % stat.block == 0:
+                    now = time.time()
+                    print("\t" "episodes/sec = %.1f (%.1f overall), per actor = %s" % (
+                          stat.block / max(now - block_start, 1e-9), sum(count) / max(now - start, 1e-9),
+                          "|".join(str(c) for c in count)))
+                    print()
+                    block_start = now
+                if stat.is_finished():
+                    break
+            if idle:
+                time.sleep(0.0005)
+    finally:
+        stop.set()
+        for proc in procs:
+            while proc.is_alive():
+                for channel in rings:
+                    channel.get()
+                proc.join(0.01)
+        elapsed = max(time.time() - start, 1e-9)
+        print("%d actors, %d episodes in %.1f sec, %.1f episodes/sec, %.1f episodes/sec per actor" % (
+              actors, sum(count), elapsed, sum(count) / elapsed, sum(count) / elapsed / actors))
+        for channel in rings:
+            channel.close(unlink = True)
+        shared.close(unlink = True)
+    return
+
+
+evaluation = None # the (play, evil, text) of the evaluation workers, inherited by fork
+
+
+def ranges(start, total, block, workers):
+    """
+    split the games [start, total) into contiguous ranges of at most 'block' games that do not cross a block boundary,
+    small enough to keep 'workers' busy until the end
+    """
+    size = max(1, min(block, -(-(total - start) // (workers * 8))))
+    result = []
+    while start < total:
+        end = min(start + size, (start // block + 1) * block, total)
+        result += [(start, end)]
+        start = end
+    return result
+
+
+def games(task):
+    """ play the games [start, end) of a range in a worker, game g with the random streams of index g """
+    play, evil, text = evaluation
+    start, end = task
+    outcomes = []
+    for g in range(start, end):
+        play.reseed(g)
+        evil.reseed(g)
+        play.open_episode("~:" + evil.name())
+        evil.open_episode(play.name() + ":~")
+        game = episode()
+        game.open_episode(play.name() + ":" + evil.name())
+        game.play(play, evil)
+        win = game.last_turns(play, evil)
+        game.close_episode(win.name())
+        play.close_episode(win.name())
+        evil.close_episode(win.name())
+        score, tile, steps, times = statistic.record(game)
+        outcomes += [outcome(score, game.state().state[:], steps, times, str(game) if text else "")]
+    return outcomes
+
+
+def evaluate(stat, play, evil, workers, text = False):
+    """
+    play the remaining games of 'stat' with 'workers' processes forked after the tables are loaded,
+    so they share the tables copy-on-write; the outcomes of the ranges are merged into 'stat' in order
+    game g uses the streams 'stream=g' of the seeds of the agents, so the games do not depend on 'workers'
+    if 'text', the episodes are sent back as well, to be saved or logged
+    """
+    global evaluation
+    if not play.test:
+        raise ValueError("the evaluation workers do not train, use load= without train")
+    evaluation = play, evil, text
+    tasks = ranges(stat.count, stat.total, stat.block, workers)
+    start = time.time()
+    count = stat.count
+    with multiprocessing.get_context("fork").Pool(workers) as pool:
+        for outcomes in pool.imap(games, tasks):
+            stat.merge(outcomes)
+    evaluation = None
+    elapsed = max(time.time() - start, 1e-9)
+    print("%d workers, %d episodes in %.1f sec, %.1f episodes/sec" % (workers, stat.count - count, elapsed, (stat.count - count) / elapsed))
+    return
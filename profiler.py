@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+"""
+Opt-in per-phase timers and call counters of the training loop
+"""
+
+from agent import weight_agent, rndenv
+from episode import episode
+from statistic import statistic
+import ntuple
+import json
+import time
+
+
+class profiler:
+    """
+    time the phases of the training loop with perf_counter_ns
+    install() wraps the methods of each phase, so nothing is measured (and nothing costs) until it is called
+
+    the time of a phase is exclusive: while a phase calls into another one (e.g. td_learning computing
+    features in take_action), the time is charged to the inner phase only
+    """
+
+    # phase name -> the (class, method) it covers
+    phases = {
+        "agent": [(weight_agent, "take_action")],
+        "environment": [(rndenv, "take_action")],
+        "apply": [(episode, "apply_action")],
+        "features": [(ntuple.layout, "features"), (ntuple.layout, "batch_features")],
+        "update": [(weight_agent, "update_weight")],
+        "statistic": [(statistic, "open_episode"), (statistic, "close_episode"), (statistic, "append")],
+    }
+
+    def __init__(self):
+        self.total = {phase: [0, 0] for phase in profiler.phases} # phase -> calls, ns
+        self.block = {phase: [0, 0] for phase in profiler.phases}
+        self.stack = [] # [phase, start ns] of the running phases, the innermost last
+        self.originals = []
+        self.start = self.block_start = time.perf_counter_ns()
+        return
+
+    def enter(self, phase):
+        now = time.perf_counter_ns()
+        if self.stack:
+            self.charge(self.stack[-1][0], now - self.stack[-1][1], 0)
+        self.stack.append([phase, now])
+        return
+
+    def leave(self):
+        now = time.perf_counter_ns()
+        phase, start = self.stack.pop()
+        self.charge(phase, now - start, 1)
+        if self.stack:
+            self.stack[-1][1] = now
+        return
+
+    def charge(self, phase, ns, calls):
+        self.total[phase][0] += calls
+        self.total[phase][1] += ns
+        self.block[phase][0] += calls
+        self.block[phase][1] += ns
+        return
+
+    def wrap(self, cls, name, phase):
+        original = cls.__dict__[name]
+        def timed(*args, **kwargs):
+            self.enter(phase)
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.leave()
+        timed.__wrapped__ = original
+        timed.__doc__ = original.__doc__
+        setattr(cls, name, timed)
+        self.originals.append((cls, name, original))
+        return
+
+    def install(self):
+        """ wrap the methods of all phases, and print the breakdown after each statistic.show() """
+        for phase, methods in profiler.phases.items():
+            for cls, name in methods:
+                self.wrap(cls, name, phase)
+        show = statistic.__dict__["show"]
+        def show_and_report(stat, *args, **kwargs):
+            result = show(stat, *args, **kwargs)
+            print(self.report())
+            return result
+        setattr(statistic, "show", show_and_report)
+        self.originals.append((statistic, "show", show))
+        self.start = self.block_start = time.perf_counter_ns()
+        return
+
+    def uninstall(self):
+        """ restore the original methods """
+        for cls, name, original in reversed(self.originals):
+            setattr(cls, name, original)
+        self.originals = []
+        return
+
+    def report(self, counters = None, elapsed = None):
+        """
+        the breakdown of the phases since the last report, or of 'counters' over 'elapsed' ns
+        each line shows the share of the wall time, the calls, and the time per call
+        the time outside all phases (e.g. the loop itself) is shown as 'other'
+        """
+        now = time.perf_counter_ns()
+        if counters is None:
+            counters, elapsed = self.block, now - self.block_start
+            self.block = {phase: [0, 0] for phase in profiler.phases}
+            self.block_start = now
+        elapsed = max(elapsed, 1)
+        lines = []
+        for phase, (calls, ns) in counters.items():
+            lines += ["\t" "%-12s" "%5.1f%%" "\t" "%d calls" "\t" "%.1f us/call" % (phase, ns * 100 / elapsed, calls, ns / 1000 / max(calls, 1))]
+        other = elapsed - sum(ns for calls, ns in counters.values())
+        lines += ["\t" "%-12s" "%5.1f%%" "\t" "%.3f sec in total" % ("other", other * 100 / elapsed, elapsed / 1e9)]
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """ the breakdown of the whole run """
+        return self.report(self.total, time.perf_counter_ns() - self.start)
+
+    def dump(self, path):
+        """ save the counters of the whole run as flat JSON """
+        elapsed = time.perf_counter_ns() - self.start
+        phases = {phase: {"calls": calls, "ns": ns, "ns_per_call": ns / max(calls, 1), "share": ns / max(elapsed, 1)}
+                  for phase, (calls, ns) in self.total.items()}
+        with open(path, "w") as output:
+            json.dump({"elapsed_ns": elapsed, "phases": phases}, output, indent = 2)
+        return
+
+
+if __name__ == '__main__':
+    print('Threes Demo: profiler.py\n')
+
+    prof = profiler()
+    prof.install()
+    play = weight_agent("name=td_learning init=1771561 seed=1")
+    evil = rndenv("seed=2")
+    stat = statistic(20, 10)
+    while not stat.is_finished():
+        stat.open_episode(play.name() + ":" + evil.name())
+        afterstates, rewards = stat.back().play(play, evil)
+        stat.close_episode(play.name())
+        features = play.layout.batch_features(afterstates)
+        play.update_weight(features[:-1], rewards, features[1:])
+    prof.uninstall()
+    print(prof.summary())
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+"""
+Export quantized inference-only tables, and compare them with the float32 tables
+"""
+
+from agent import weight_agent, rndenv
+from action import action
+from episode import episode
+import contextlib
+import resource
+import time
+import sys
+import io
+import os
+import numpy as np
+
+
+def resident():
+    """ the resident memory of this process in MB """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1 << 20)
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def export(source, target, dtype = "int16"):
+    """ quantize the tables of a weight file into 'target' """
+    with contextlib.redirect_stdout(io.StringIO()):
+        play = weight_agent("name=td_learning load=" + source)
+    play.save_quantized(target, dtype)
+    return
+
+
+def evaluate(path, games, seed):
+    """
+    load a weight file and play 'games' fixed games in test mode
+    return the agent, the games, and the load time/memory
+    """
+    before = resident()
+    tick = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        play = weight_agent("name=td_learning load=" + path)
+    elapsed = time.perf_counter() - tick
+    memory = resident() - before
+    result = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        evil = rndenv("seed=%d" % seed)
+    for i in range(games):
+        evil.open_episode()
+        game = episode()
+        game.play(play, evil)
+        result += [game]
+    return play, result, elapsed, memory
+
+
+def positions(games):
+    """ the boards before each player move of some games """
+    states = []
+    for game in games:
+        state = game.initial_state()
+        for move, reward, usage in game.ep_moves:
+            if move.code & 0xff000000 == action.slide.type:
+                states += [state.copy()]
+            move.apply(state)
+    return states
+
+
+if __name__ == '__main__':
+    print('Threes Demo: quantize.py\n')
+
+    if len(sys.argv) >= 3 and sys.argv[1] != "compare":
+        export(sys.argv[1], sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else "int16")
+        print("%s (%.1f MB) -> %s (%.1f MB)" % (sys.argv[1], os.path.getsize(sys.argv[1]) / (1 << 20),
+                                              sys.argv[2], os.path.getsize(sys.argv[2]) / (1 << 20)))
+    elif len(sys.argv) >= 4:
+        games = int(sys.argv[4]) if len(sys.argv) > 4 else 100
+        base_play, base, base_time, base_memory = evaluate(sys.argv[2], games, 1)
+        base_scores = [game.score() for game in base]
+        print("%s: load %.3f sec, %.1f MB, avg = %.1f" % (sys.argv[2], base_time, base_memory, np.mean(base_scores)))
+        play, result, load_time, memory = evaluate(sys.argv[3], games, 1)
+        scores = [game.score() for game in result]
+        states = positions(base)
+        same = sum(base_play.take_action(state)[1] == play.take_action(state)[1] for state in states)
+        print("%s: load %.3f sec, %.1f MB, avg = %.1f (%+.1f), the same move in %.2f%% of %d positions" % (
+              sys.argv[3], load_time, memory, np.mean(scores), np.mean(scores) - np.mean(base_scores), same * 100 / len(states), len(states)))
+    else:
+        print("usage: quantize.py <weight> <output> [int16|float16] | quantize.py compare <weight> <quantized> [games]")
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+"""
+Expectimax search over the TD network for Threes
+"""
+
+from bitboard import bitboard, transpose, slide_raw, row_left, row_right, score_left, score_right
+import time
+
+
+# the cells where rndenv may place a tile after each slide (up, right, down, left)
+spawn_cells = ((12, 13, 14, 15), (0, 4, 8, 12), (0, 1, 2, 3), (3, 7, 11, 15))
+
+full_bag = 0b111 # bit t - 1 is set if tile t is still in the bag
+
+
+def afterstates(raw):
+    """ the (afterstate, reward) of a packed board for each opcode, the reward of an illegal slide is -1 """
+    tran = transpose(raw)
+    up, reward_up = slide_raw(tran, row_left, score_left)
+    right, reward_right = slide_raw(raw, row_right, score_right)
+    down, reward_down = slide_raw(tran, row_right, score_right)
+    left, reward_left = slide_raw(raw, row_left, score_left)
+    up, down = transpose(up), transpose(down)
+    return ((up, reward_up if up != raw else -1), (right, reward_right if right != raw else -1),
+            (down, reward_down if down != raw else -1), (left, reward_left if left != raw else -1))
+
+
+class timeout(Exception):
+    """ raised inside the search when the time budget of a move is used up """
+    pass
+
+
+class expectimax:
+    """
+    expectimax search with iterative deepening under a time budget
+    max nodes are player slides, chance nodes are rndenv placements on the spawn cells of the last slide
+    with a tile drawn from the bag, and the leaves are evaluated by the TD network of 'agent'
+
+    chance nodes are stored in a transposition table keyed by (afterstate, last slide, bag),
+    a slot is replaced when the new result is searched at least as deep as the stored one
+    """
+
+    def __init__(self, agent, budget = 10, depth = 3, size = 1 << 20):
+        self.agent = agent
+        self.budget = budget / 1000 # sec
+        self.max_depth = depth
+        self.size = size
+        self.table = [None] * size
+        self.nodes, self.probes, self.hits, self.elapsed, self.depths, self.moves = 0, 0, 0, 0.0, 0, 0
+        self.open_episode()
+        return
+
+    def open_episode(self):
+        """ forget the bag and the transposition table, the weights may have changed """
+        self.bag = full_bag
+        self.last = None
+        self.table = [None] * self.size
+        return
+
+    def observe(self, raw):
+        """ update the bag with the tile that rndenv placed since the last move """
+        if self.last is None:
+            self.bag = full_bag # the initial 9 tiles empty the bag exactly 3 times
+            return
+        placed = [(raw >> (pos << 2)) & 0x0f for pos in range(16) if not (self.last >> (pos << 2)) & 0x0f and (raw >> (pos << 2)) & 0x0f]
+        if len(placed) != 1 or placed[0] > 3:
+            self.bag = full_bag
+            return
+        self.bag &= ~(1 << (placed[0] - 1))
+        if not self.bag:
+            self.bag = full_bag
+        return
+
+    def take_action(self, state):
+        """ return the best opcode of a board, or -1 if there is no legal slide """
+        raw = bitboard(state).raw
+        self.observe(raw)
+        self.deadline = time.perf_counter() + self.budget
+        start, nodes = time.perf_counter(), self.nodes
+        best, searched = -1, 0
+        for depth in range(1, self.max_depth + 1):
+            try:
+                op, value = self.search_max(raw, self.bag, depth)
+            except timeout:
+                break
+            best, searched = op, depth
+        self.depths += searched
+        self.elapsed += time.perf_counter() - start
+        self.moves += 1
+        if best != -1:
+            self.last = afterstates(raw)[best][0]
+        return best
+
+    def search_max(self, raw, bag, depth):
+        """ the best (opcode, value) of a max node """
+        self.nodes += 1
+        best, best_value = -1, 0.0
+        for op, (after, reward) in enumerate(afterstates(raw)):
+            if reward == -1:
+                continue
+            value = reward + self.search_chance(after, op, bag, depth)
+            if best == -1 or value > best_value:
+                best, best_value = op, value
+        return best, best_value
+
+    def search_chance(self, after, op, bag, depth):
+        """ the expected value of an afterstate, 'depth' counts the remaining player slides including the last one """
+        self.nodes += 1
+        if not (self.nodes & 0x3ff) and depth > 1 and time.perf_counter() > self.deadline:
+            raise timeout()
+
+        # a leaf does not depend on the last slide and the bag
+        key = after | (op << 64) | (bag << 66) if depth > 1 else after | (1 << 69)
+        slot = hash(key) & (self.size - 1)
+        entry = self.table[slot]
+        self.probes += 1
+        if entry is not None and entry[0] == key and entry[1] >= depth:
+            self.hits += 1
+            return entry[2]
+        if depth <= 1:
+            value = self.evaluate(after)
+            if entry is None or entry[1] <= depth:
+                self.table[slot] = key, depth, value
+            return value
+
+        cells = [pos for pos in spawn_cells[op] if not (after >> (pos << 2)) & 0x0f]
+        tiles = [tile for tile in (1, 2, 3) if bag & (1 << (tile - 1))]
+        total = 0.0
+        for pos in cells:
+            for tile in tiles:
+                remain = bag & ~(1 << (tile - 1))
+                op_next, value = self.search_max(after | (tile << (pos << 2)), remain if remain else full_bag, depth - 1)
+                total += value
+        value = total / (len(cells) * len(tiles)) if cells else 0.0
+
+        if entry is None or entry[1] <= depth:
+            self.table[slot] = key, depth, value
+        return value
+
+    def evaluate(self, after):
+        return self.agent.value(bitboard(after))
+
+    def report(self):
+        """ the search statistic since the last report """
+        text = "expectimax: %d moves, %.1f depth, %d nodes/sec, tt hit rate %.1f%% (%d/%d)" % (
+               self.moves, self.depths / max(self.moves, 1), self.nodes / max(self.elapsed, 1e-9),
+               self.hits * 100 / max(self.probes, 1), self.hits, self.probes)
+        self.nodes, self.probes, self.hits, self.elapsed, self.depths, self.moves = 0, 0, 0, 0.0, 0, 0
+        return text
+
+
+if __name__ == '__main__':
+    print('Threes Demo: search.py\n')
+
+    from agent import weight_agent
+    state = bitboard([1, 2, 3, 0, 0, 3, 0, 0, 2, 0, 0, 0, 1, 0, 3, 0])
+    play = weight_agent('name=expectimax init=1771561')
+    search = expectimax(play, budget = 100)
+    print(state)
+    print(search.take_action(state))
+    print(search.report())
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+"""
+Move server for a trained weight_agent: micro-batched inference over a local socket
+"""
+
+from agent import weight_agent
+from collections import deque
+import asyncio
+import signal
+import json
+import time
+import sys
+import os
+import numpy as np
+
+
+# the line protocol, one request per line and one response per line, in order:
+#     request  "t0 t1 ... t15"   the tile indices of a board (0 = empty, 1, 2, 3, 4 = 6-tile, ...)
+#     response "op value"        the best slide (0 up, 1 right, 2 down, 3 left, -1 none) and its reward + value
+#     request  "stats"           response: the statistic of the server as one line of JSON
+
+
+def percentile(data, q):
+    return float(np.percentile(data, q)) if len(data) else 0.0
+
+
+class server:
+    """
+    evaluate the requests of all connections in micro-batches
+    a batch is closed when it has 'batch' boards, or 'delay' ms after its first board arrived
+    """
+
+    def __init__(self, play, batch = 256, delay = 1.0):
+        self.play = play
+        self.batch = batch
+        self.delay = delay / 1000 # sec
+        self.queue = asyncio.Queue()
+        self.latency = deque(maxlen = 100000) # sec of the recent requests
+        self.done = deque(maxlen = 100000) # the time the recent requests were answered
+        self.sizes = deque(maxlen = 10000) # the recent batch sizes
+        self.requests = 0
+        return
+
+    async def batcher(self):
+        """ collect the queued boards into batches and resolve their futures """
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self.queue.get()]
+            deadline = loop.time() + self.delay
+            while len(items) < self.batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    items += [await asyncio.wait_for(self.queue.get(), timeout)]
+                except asyncio.TimeoutError:
+                    break
+                while len(items) < self.batch and not self.queue.empty():
+                    items += [self.queue.get_nowait()]
+            boards = np.array([board for board, future, tick in items], dtype = np.uint8)
+            ops, values = self.play.act_batch(boards)
+            now = time.perf_counter()
+            for (board, future, tick), op, value in zip(items, ops.tolist(), values.tolist()):
+                if not future.done():
+                    future.set_result((op, value))
+                self.latency.append(now - tick)
+                self.done.append(now)
+            self.sizes.append(len(items))
+            self.requests += len(items)
+
+    async def handle(self, reader, writer):
+        """ serve one connection, requests are answered in order """
+        loop = asyncio.get_running_loop()
+        pending = asyncio.Queue()
+        async def reply():
+            while True:
+                future = await pending.get()
+                if future is None:
+                    break
+                result = await future
+                writer.write((result if isinstance(result, str) else "%d %r\n" % result).encode())
+                await writer.drain()
+        replier = asyncio.ensure_future(reply())
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                line = line.decode().strip()
+                future = loop.create_future()
+                if line == "stats":
+                    future.set_result(json.dumps(self.stats()) + "\n")
+                else:
+                    try:
+                        board = [int(tile) for tile in line.split()]
+                        if len(board) != 16 or min(board) < 0 or max(board) > 15:
+                            raise ValueError()
+                    except ValueError:
+                        future.set_result("error bad board\n")
+                    else:
+                        self.queue.put_nowait((board, future, time.perf_counter()))
+                await pending.put(future)
+        finally:
+            await pending.put(None)
+            await replier
+            writer.close()
+        return
+
+    def stats(self):
+        """ the throughput, the latency percentiles (ms) and the average batch size of the recent requests """
+        latency = np.array(self.latency) * 1000
+        elapsed = max(self.done[-1] - self.done[0], 1e-9) if len(self.done) > 1 else 1.0
+        return {"requests": self.requests, "throughput": len(self.done) / elapsed,
+                "p50": percentile(latency, 50), "p90": percentile(latency, 90), "p99": percentile(latency, 99),
+                "max": float(latency.max()) if len(latency) else 0.0,
+                "batch": float(np.mean(self.sizes)) if self.sizes else 0.0}
+
+    def report(self):
+        stats = self.stats()
+        return "%d requests, %.1f requests/sec, latency p50 = %.3f ms, p90 = %.3f ms, p99 = %.3f ms, max = %.3f ms, avg batch = %.1f" % (
+               stats["requests"], stats["throughput"], stats["p50"], stats["p90"], stats["p99"], stats["max"], stats["batch"])
+
+    async def reporter(self, interval):
+        """ print the statistic every 'interval' sec while there are requests """
+        last = 0
+        while True:
+            await asyncio.sleep(interval)
+            if self.requests != last:
+                print(self.report())
+                last = self.requests
+
+
+async def serve(play, path, port, batch, delay, interval):
+    host = server(play, batch, delay)
+    if path:
+        if os.path.exists(path):
+            os.remove(path)
+        listener = await asyncio.start_unix_server(host.handle, path = path)
+    else:
+        listener = await asyncio.start_server(host.handle, "127.0.0.1", port)
+    print("serving on", path if path else "127.0.0.1:%d" % port)
+    stop = asyncio.Event()
+    for sig in [signal.SIGINT, signal.SIGTERM]:
+        try:
+            asyncio.get_running_loop().add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass # e.g. on Windows, where Ctrl+C raises KeyboardInterrupt instead
+    tasks = [asyncio.ensure_future(host.batcher()), asyncio.ensure_future(host.reporter(interval))]
+    try:
+        async with listener:
+            await stop.wait()
+    finally:
+        for task in tasks:
+            task.cancel()
+        print(host.report())
+    return
+
+
+if __name__ == '__main__':
+    print('Threes Demo: ' + " ".join(sys.argv))
+    print()
+
+    play_args = "name=td_learning load=weight.bin"
+    path, port = "", 0
+    batch, delay, interval = 256, 1.0, 10.0
+    for para in sys.argv[1:]:
+        if "--play=" in para:
+            play_args = para[(para.index("=") + 1):]
+        elif "--socket=" in para:
+            path = para[(para.index("=") + 1):]
+        elif "--port=" in para:
+            port = int(para[(para.index("=") + 1):])
+        elif "--batch=" in para:
+            batch = int(para[(para.index("=") + 1):])
+        elif "--delay=" in para:
+            delay = float(para[(para.index("=") + 1):])
+        elif "--report=" in para:
+            interval = float(para[(para.index("=") + 1):])
+    if not path and not port:
+        port = 7777
+
+    play = weight_agent(play_args)
+    try:
+        asyncio.run(serve(play, path, port, batch, delay, interval))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+"""
+Lockstep batched simulator for Threes: K games advance together as one (K, 16) array
+"""
+
+from bitboard import row_left, row_right, score_left, score_right
+from episode import outcome
+from action import action
+import numpy as np
+import time
+
+
+# the row tables of bitboard as arrays, indexed by a packed row c0 | c1 << 4 | c2 << 8 | c3 << 12
+table_row = np.array([row_left, row_right], dtype = np.int64)
+table_score = np.array([score_left, score_right], dtype = np.int64)
+row_shift = np.array([0, 4, 8, 12], dtype = np.int64)
+
+# the cells where rndenv may place a tile after each slide (up, right, down, left), and before the first slide
+spawn_mask = np.zeros((5, 16), dtype = bool)
+spawn_mask[0, [12, 13, 14, 15]] = True
+spawn_mask[1, [0, 4, 8, 12]] = True
+spawn_mask[2, [0, 1, 2, 3]] = True
+spawn_mask[3, [3, 7, 11, 15]] = True
+spawn_mask[4, :] = True
+
+
+def slide_rows(rows, side):
+    """ slide (K, 4, 4) rows to the left (side = 0) or to the right (side = 1), return the rows and the rewards """
+    packed = (rows << row_shift).sum(axis = 2)
+    moved = (table_row[side][packed][:, :, None] >> row_shift) & 0x0f
+    return moved, table_score[side][packed].sum(axis = 1)
+
+
+def slide_all(boards):
+    """
+    the afterstates of (K, 16) boards in all four directions
+    return (K, 4, 16) afterstates and (K, 4) rewards indexed by opcode, the reward of an illegal slide is -1
+    """
+    grid = boards.reshape(-1, 4, 4).astype(np.int64)
+    tran = grid.transpose(0, 2, 1)
+    up, reward_up = slide_rows(tran, 0)
+    right, reward_right = slide_rows(grid, 1)
+    down, reward_down = slide_rows(tran, 1)
+    left, reward_left = slide_rows(grid, 0)
+    after = np.stack([up.transpose(0, 2, 1), right, down.transpose(0, 2, 1), left], axis = 1).reshape(-1, 4, 16)
+    reward = np.stack([reward_up, reward_right, reward_down, reward_left], axis = 1)
+    legal = (after != boards[:, None, :]).any(axis = 2)
+    return after.astype(boards.dtype), np.where(legal, reward, -1)
+
+
+def choose(mask, uniform):
+    """ choose one True column of each row of 'mask' uniformly, with one uniform number per row """
+    count = mask.sum(axis = 1)
+    nth = np.minimum((uniform * count).astype(np.int64), np.maximum(count - 1, 0))
+    return np.argmax(np.cumsum(mask, axis = 1) > nth[:, None], axis = 1), count
+
+
+def random_policy(rng):
+    """ select a legal slide uniformly, the same as the dummy agent """
+    def policy(boards, after, reward):
+        return choose(reward != -1, rng.random(len(boards)))[0]
+    return policy
+
+
+def greedy_policy(boards, after, reward):
+    """ select the slide with the largest reward, the same as the greedy agent """
+    return np.argmax(reward, axis = 1)
+
+
+def weight_policy(agent):
+    """ select the slide with the largest reward plus afterstate value, the same as td_learning in test mode """
+    def policy(boards, after, reward):
+        value = agent.sum_batch(agent.layout.batch_features(after.reshape(-1, 16))).reshape(-1, 4) + reward
+        return np.argmax(np.where(reward != -1, value, -np.inf), axis = 1)
+    return policy
+
+
+class simulator:
+    """
+    K games of threes played in lockstep
+    every step all live games slide at once, then rndenv places a tile in every game at once,
+    finished games are retired and their slots are refilled with new games
+    """
+
+    def __init__(self, width = 1024, seed = None):
+        self.width = width
+        self.rng = np.random.default_rng(seed)
+        self.boards = np.zeros((width, 16), dtype = np.uint8)
+        self.bag = np.ones((width, 3), dtype = bool) # remaining tiles 1, 2, 3 of the bag
+        self.score = np.zeros(width, dtype = np.int64)
+        self.moves = np.zeros(width, dtype = np.int64)
+        self.usage = np.zeros((width, 2), dtype = np.float64) # time usage of player, environment
+        self.live = np.zeros(width, dtype = bool)
+        self.trace = None # the moves of each game as text, only if the episodes are saved or logged
+        self.opened = np.zeros(width, dtype = np.int64) # the time each game is opened, in millisec
+        return
+
+    def place(self, slots, last):
+        """ let rndenv place a tile in each game of 'slots', 'last' is the last slide (4 if none) """
+        mask = (self.boards[slots] == 0) & spawn_mask[last]
+        pos, count = choose(mask, self.rng.random(len(slots)))
+        empty = self.bag[slots].sum(axis = 1) == 0
+        self.bag[slots[empty]] = True
+        tile, _ = choose(self.bag[slots], self.rng.random(len(slots)))
+        ok = count > 0
+        slots, pos, tile = slots[ok], pos[ok], tile[ok]
+        self.boards[slots, pos] = tile + 1
+        self.bag[slots, tile] = False
+        self.moves[slots] += 1
+        if self.trace is not None:
+            for i, cell, index in zip(slots.tolist(), pos.tolist(), (tile + 1).tolist()):
+                self.trace[i] += [str(action.place(cell, index))]
+        return ok
+
+    def open(self, slots):
+        """ start new games in 'slots' with the initial 9 tiles """
+        self.boards[slots] = 0
+        self.bag[slots] = True
+        self.score[slots] = 0
+        self.moves[slots] = 0
+        self.usage[slots] = 0
+        self.live[slots] = True
+        if self.trace is not None:
+            for i in slots.tolist():
+                self.trace[i] = []
+            self.opened[slots] = int(round(time.time() * 1000))
+        tick = time.perf_counter()
+        for i in range(9):
+            self.place(slots, np.full(len(slots), 4))
+        self.usage[slots, 1] += (time.perf_counter() - tick) * 1000 / max(len(slots), 1)
+        return
+
+    def close(self, slots, stat, flag):
+        """
+        retire the games in 'slots' and report them to 'stat', 'flag' is the "player:environment" of the games
+        a game ends when the player cannot slide, so it is closed by the environment, as rndenv closes an episode
+        """
+        self.live[slots] = False
+        if stat is None:
+            return
+        for i in slots:
+            size = int(self.moves[i])
+            steps = size, int((size - 1) / 2), size - int((size - 1) / 2)
+            usage = self.usage[i]
+            text = ""
+            if self.trace is not None:
+                opened = int(self.opened[i])
+                text = "%s@%d|%s|%s@%d" % (flag, opened, "".join(self.trace[i]), flag.split(":")[-1], opened + int(round(usage.sum())))
+            stat.append(outcome(int(self.score[i]), self.boards[i].tolist(), steps, (usage.sum(), usage[0], usage[1]), text))
+        return
+
+    def run(self, policy, total, stat = None, flag = "", text = False):
+        """
+        play 'total' games with 'policy', a function of (boards, afterstates, rewards) returning the slides
+        report each finished game to 'stat' as an outcome, return the number of games finished
+        if 'text', the outcomes carry the text of the episodes, to be saved or logged
+        """
+        self.trace = [[] for i in range(self.width)] if text else None
+        started, finished = 0, 0
+        slots = np.arange(min(self.width, total))
+        self.live[:] = False
+        self.open(slots)
+        started += len(slots)
+        while finished < total:
+            slots = np.flatnonzero(self.live)
+            tick = time.perf_counter()
+            after, reward = slide_all(self.boards[slots])
+            legal = (reward != -1).any(axis = 1)
+            op = policy(self.boards[slots], after, reward)
+            ok = np.flatnonzero(legal)
+            self.boards[slots[ok]] = after[ok, op[ok]]
+            self.score[slots[ok]] += reward[ok, op[ok]]
+            self.moves[slots[ok]] += 1
+            if self.trace is not None:
+                for i, slide, gain in zip(slots[ok].tolist(), op[ok].tolist(), reward[ok, op[ok]].tolist()):
+                    self.trace[i] += [str(action.slide(slide)) + ("[" + str(gain) + "]" if gain else "")]
+            self.usage[slots, 0] += (time.perf_counter() - tick) * 1000 / len(slots)
+
+            tick = time.perf_counter()
+            placed = np.zeros(len(slots), dtype = bool)
+            placed[ok] = self.place(slots[ok], op[ok])
+            self.usage[slots, 1] += (time.perf_counter() - tick) * 1000 / len(slots)
+
+            done = slots[~placed]
+            if len(done):
+                done = done[:total - finished]
+                self.close(done, stat, flag)
+                finished += len(done)
+                refill = done[:max(total - started, 0)]
+                if len(refill):
+                    self.open(refill)
+                    started += len(refill)
+        return finished
+
+
+if __name__ == '__main__':
+    print('Threes Demo: simulator.py\n')
+
+    from statistic import statistic
+    stat = statistic(10000, 1000)
+    sim = simulator(1000, seed = 0)
+    tick = time.time()
+    sim.run(greedy_policy, stat.total, stat)
+    print("%d games in %.1f sec" % (stat.count, time.time() - tick))
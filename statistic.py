@@ -10,7 +10,68 @@ Author: Hung Guei (moporgic)
 
 from board import board
 from action import action
-from episode import episode
+from episode import episode, episodes
+from collections import deque
+import io
+
+
+class aggregate:
+    """ running sums over the records of some episodes, see statistic.record() """
+    
+    def __init__(self):
+        self.count = 0
+        self.score = 0
+        self.best = 0 # max score, only valid if nothing is removed
+        self.tiles = [0] * 64 # count of each max tile
+        self.steps = [0, 0, 0] # all, player, environment
+        self.times = [0, 0, 0] # all, player, environment
+        return
+    
+    def add(self, record, sign = 1):
+        score, tile, steps, times = record
+        self.count += sign
+        self.score += sign * score
+        self.best = max(self.best, score)
+        self.tiles[tile] += sign
+        for i in range(3):
+            self.steps[i] += sign * steps[i]
+            self.times[i] += sign * times[i]
+        return
+    
+    def remove(self, record):
+        self.add(record, -1)
+        return
+
+
+class sliding(aggregate):
+    """ an aggregate over a queue of records, which are removed oldest first, with a running max score """
+    
+    def __init__(self):
+        super().__init__()
+        self.records = deque()
+        self.peak = deque() # (index, score) with decreasing scores, the front is the max score of the records
+        self.pushed, self.popped = 0, 0 # the number of records added, removed
+        return
+    
+    def push(self, record):
+        self.records.append(record)
+        self.add(record)
+        while self.peak and self.peak[-1][1] <= record[0]:
+            self.peak.pop()
+        self.peak.append((self.pushed, record[0]))
+        self.pushed += 1
+        return
+    
+    def pop(self):
+        self.remove(self.records.popleft())
+        if self.peak and self.peak[0][0] == self.popped:
+            self.peak.popleft()
+        self.popped += 1
+        return
+    
+    def top(self):
+        """ the max score of the records """
+        return self.peak[0][1] if self.peak else 0
 
 
 class statistic:
@@ -27,8 +88,39 @@ class statistic:
         self.total = total
         self.block = block if block else total
         self.limit = limit if limit else total
-        self.data = []
+        self.data = deque()
         self.count = 0
+        self.log = None # an eplog.writer that receives every closed episode
+        self.clear()
+        return
+    
+    def clear(self):
+        """ reset the running aggregates """
+        self.window = sliding() # all closed episodes in data
+        self.last = sliding() # the last 'block' closed episodes
+        return
+    
+    @staticmethod
+    def record(ep):
+        """ the numbers of an episode needed by show(): score, max tile, steps, and time usages """
+        steps = ep.step(), ep.step(action.slide.type), ep.step(action.place.type)
+        times = ep.time(), ep.time(action.slide.type), ep.time(action.place.type)
+        return ep.score(), max(ep.state().state), steps, times
+    
+    def add_record(self, ep):
+        """ add a closed episode to the aggregates """
+        record = self.record(ep)
+        self.window.push(record)
+        self.last.push(record)
+        if self.last.count > self.block:
+            self.last.pop()
+        return
+    
+    def drop_record(self):
+        """ remove the oldest episode of data from the aggregates """
+        self.data.popleft()
+        if len(self.window.records) > len(self.data):
+            self.window.pop()
         return
     
     def show(self, tstat = True):
@@ -54,22 +146,14 @@ class statistic:
          '93.7%': 93.7% (937 games) reached 8192-tiles (a.k.a. win rate of 8192-tile)
          '22.4%': 22.4% (224 games) terminated with 8192-tiles (the largest)
         """
-        blk = min(len(self.data), self.block)
-        stat = [0] * 64
-        sop, pop, eop = 0, 0, 0
-        sdu, pdu, edu = 0, 0, 0
-        ssc, msc = 0, 0
-        for i in range(1, blk + 1):
-            ep = self.data[-i]
-            ssc += ep.score()
-            msc = max(ep.score(), msc)
-            stat[max(ep.state().state)] += 1
-            sop += ep.step()
-            pop += ep.step(action.slide.type)
-            eop += ep.step(action.place.type)
-            sdu += ep.time()
-            pdu += ep.time(action.slide.type)
-            edu += ep.time(action.place.type)
+        # the aggregates cover either all episodes kept in data, or the last 'block' episodes
+        acc = self.window if self.block >= self.window.count else self.last
+        blk = acc.count
+        stat = acc.tiles
+        sop, pop, eop = acc.steps
+        sdu, pdu, edu = acc.times
+        ssc = acc.score
+        msc = acc.top()
         
         print("%d\t" "avg = %d, max = %d, ops = %d (%d|%d)" % (self.count, ssc / blk, msc, sop * 1000 / sdu, pop * 1000 / pdu, eop * 1000 / edu))
         
@@ -90,7 +174,7 @@ class statistic:
     
     def summary(self):
         block = self.block
-        self.block = len(self.data)
+        self.block = max(len(self.data), self.window.count)
         self.show()
         self.block = block
         return
@@ -99,19 +183,47 @@ class statistic:
         return self.count >= self.total
     
     def open_episode(self, flag = ""):
-        if self.count >= self.limit:
-            self.data = self.data[1:]
+        if self.count >= self.limit and self.data:
+            self.drop_record()
         self.count += 1
-        self.data += [episode()]
+        self.data.append(episode())
         self.data[-1].open_episode(flag)
         return
     
     def close_episode(self, flag = ""):
         self.data[-1].close_episode(flag)
+        self.add_record(self.data[-1])
+        if self.log is not None:
+            self.log.append(self.data[-1])
         if self.count % self.block == 0:
             self.show()
         return
     
+    def append(self, ep):
+        """ add an episode which is already closed, e.g. an outcome from an actor process """
+        if self.count >= self.limit and self.data:
+            self.drop_record()
+        self.count += 1
+        self.data.append(ep)
+        self.add_record(ep)
+        if self.log is not None and str(ep):
+            if not isinstance(ep, episode):
+                ep = episode()
+                ep.load(io.StringIO(str(self.data[-1])))
+            self.log.append(ep)
+        if self.count % self.block == 0:
+            self.show()
+        return
+    
+    def merge(self, outcomes):
+        """
+        add the outcomes of episodes closed elsewhere in order, e.g. a range of games of an evaluation worker
+        they are kept and trimmed to 'limit' like the episodes added by append()
+        """
+        for ep in outcomes:
+            self.append(ep)
+        return
+    
     def at(self, i):
         return self.data[i]
     
@@ -128,16 +240,12 @@ class statistic:
     
     def load(self, input):
         """ deserialize from a file object """
-        self.data = []
-        while True:
-            # load an episode
-            ep = episode()
-            if ep.load(input):
-                self.data += [ep]
-            else:
-                break
+        self.data = deque(episodes(input))
         self.total = max(self.total, len(self.data))
         self.count = len(self.data)
+        self.clear()
+        for ep in self.data:
+            self.add_record(ep)
         return True
     
     def __str__(self):
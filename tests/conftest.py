@@ -0,0 +1,29 @@
+"""
+the modules are scripts in the top directory of the repository, make them importable by the tests
+"""
+
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent import weight_agent
+import contextlib
+import pytest
+import json
+import io
+
+
+@pytest.fixture
+def small_agent(tmp_path):
+    """
+    a factory of td_learning agents with small tables, 'patterns' is the list of tuples of the layout
+    the tables are sized for the longest tuple and start at 0, 'options' are the other agent options
+    """
+    def create(patterns, options = ""):
+        path = str(tmp_path / "small.json")
+        with open(path, "w") as output:
+            json.dump({"name": "small", "patterns": patterns}, output)
+        with contextlib.redirect_stdout(io.StringIO()):
+            return weight_agent("name=td_learning init=%d tuples=%s %s" % (11 ** max(len(p) for p in patterns), path, options))
+    return create
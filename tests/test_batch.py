@@ -0,0 +1,56 @@
+"""
+act_batch() and evaluate_batch() must agree exactly with value() and take_action() of td_learning
+"""
+
+from agent import weight_agent
+from benchmark import corpus
+from board import board
+import numpy as np
+import contextlib
+import pytest
+import io
+
+
+def agent(tmp_path, small_agent, quantized):
+    """ a td_learning agent with random small tables of two 6-tuples, or the same tables quantized to int16 """
+    play = small_agent([[0, 1, 2, 3, 4, 5], [4, 5, 6, 8, 9, 10]], "seed=1")
+    rng = np.random.default_rng(1)
+    for w in play.net:
+        w.value[:] = rng.normal(0, 100, len(w)).astype(np.float32)
+    if quantized:
+        with contextlib.redirect_stdout(io.StringIO()):
+            play.save_quantized(str(tmp_path / "small.q16"))
+            play = weight_agent("name=td_learning load=%s seed=1" % (tmp_path / "small.q16"))
+    return play
+
+
+@pytest.mark.parametrize("quantized", [False, True])
+def test_act_batch(tmp_path, small_agent, quantized):
+    play = agent(tmp_path, small_agent, quantized)
+    states = corpus(10, 1)
+    ops, best = play.act_batch(np.array(states, dtype = np.uint8))
+    values, after = play.evaluate_batch([board(state[:]) for state in states])
+    for k, state in enumerate(states):
+        for op, (afterstate, reward, legal) in enumerate(board(state[:]).afterstates()):
+            assert values[k, op] == (play.value(afterstate) + reward if legal else -np.inf)
+            if legal:
+                assert list(after[k, op]) == afterstate.state
+        move, op = play.take_action(board(state[:]))
+        assert ops[k] == op
+        assert best[k] == (values[k, op] if op != -1 else 0.0)
+    return
+
+
+def test_legal_masks(tmp_path, small_agent):
+    play = agent(tmp_path, small_agent, False)
+    states = np.array(corpus(5, 2), dtype = np.uint8)
+    masks = np.random.default_rng(2).random((len(states), 4)) < 0.5
+    values, after = play.evaluate_batch(states)
+    ops, best = play.act_batch(states, masks)
+    for k in range(len(states)):
+        allowed = [op for op in range(4) if masks[k, op] and values[k, op] != -np.inf]
+        if allowed:
+            assert ops[k] == allowed[int(np.argmax(values[k, allowed]))] and best[k] == values[k, ops[k]]
+        else:
+            assert ops[k] == -1 and best[k] == 0.0
+    return
@@ -0,0 +1,56 @@
+"""
+the bitboard must behave exactly as the list-based board
+"""
+
+from board import board
+from bitboard import bitboard
+from benchmark import corpus
+import random
+
+
+def pairs():
+    """ the same positions as a board and as a bitboard """
+    return [(board(state[:]), bitboard(state)) for state in corpus(20, 1)]
+
+
+def test_afterstates():
+    for b, bb in pairs():
+        for (after, reward, legal), (bafter, breward, blegal) in zip(b.afterstates(), bb.afterstates()):
+            assert (reward, legal) == (breward, blegal)
+            assert after.state == bafter.state
+            assert after.features() == bafter.features()
+    return
+
+
+def test_slides():
+    for b, bb in pairs():
+        assert b.features() == bb.features()
+        for op in range(-1, 5):
+            after, bafter = b.copy(), bb.copy()
+            assert after.slide(op) == bafter.slide(op)
+            assert after.state == bafter.state
+    return
+
+
+def test_transforms():
+    for b, bb in pairs():
+        for name in ['reflect_horizontal', 'reflect_vertical', 'transpose', 'rotate_right', 'rotate_left', 'reverse']:
+            getattr(b, name)()
+            getattr(bb, name)()
+            assert b.state == bb.state, name
+        for rot in range(-5, 6):
+            b.rotate(rot)
+            bb.rotate(rot)
+            assert b.state == bb.state, rot
+    return
+
+
+def test_place():
+    rng = random.Random(1)
+    b, bb = board(), bitboard()
+    for i in range(200):
+        pos, tile = rng.randrange(-1, 17), rng.randrange(0, 5)
+        assert b.place(pos, tile) == bb.place(pos, tile)
+        assert b.state == bb.state
+        assert [b[i] for i in range(16)] == [bb[i] for i in range(16)]
+    return
@@ -0,0 +1,67 @@
+"""
+the LRU value cache must return the values of value() without the cache
+"""
+
+from benchmark import corpus
+from board import board
+import numpy as np
+
+
+def agents(small_agent, options):
+    """ a td_learning agent with the value cache and one without, sharing random tables of a symmetric layout """
+    cached = small_agent([[0, 1, 2, 3], [4, 5, 6, 7]], options)
+    plain = small_agent([[0, 1, 2, 3], [4, 5, 6, 7]])
+    rng = np.random.default_rng(1)
+    for w in cached.net:
+        w.value[:] = rng.normal(0, 10, len(w)).astype(np.float32)
+    plain.net = cached.net
+    plain.link_tables()
+    return cached, plain
+
+
+def transforms(state):
+    """ the 8 rotations and reflections of a board """
+    result = []
+    for flip in [False, True]:
+        for rot in range(4):
+            b = board(state[:])
+            if flip:
+                b.reflect_horizontal()
+            b.rotate(rot)
+            result += [b]
+    return result
+
+
+def test_canonical_hits(small_agent):
+    cached, plain = agents(small_agent, "cache=100000")
+    assert cached.layout.symmetric
+    states = corpus(5, 1)
+    for state in states:
+        for b in transforms(state):
+            assert cached.value(b) == plain.value(b)
+    assert cached.cache_misses <= len(states) and cached.cache_hits >= 7 * len(states)
+    for state in states: # all hits now
+        for b in transforms(state):
+            assert cached.value(b) == plain.value(b)
+    return
+
+
+def test_eviction(small_agent):
+    cached, plain = agents(small_agent, "cache=16")
+    states = corpus(5, 2)
+    for repeat in range(2):
+        for state in states:
+            assert cached.value(board(state[:])) == plain.value(board(state[:]))
+    assert len(cached.cache) == 16 and cached.cache_evictions > 0
+    return
+
+
+def test_invalidation(small_agent):
+    cached, plain = agents(small_agent, "cache=1000 train")
+    states = corpus(3, 3)
+    before = [cached.value(board(state[:])) for state in states]
+    features = cached.layout.batch_features(np.array(states[:5]))
+    cached.update_weight(features[:-1], [1] * (len(features) - 1), features[1:])
+    after = [cached.value(board(state[:])) for state in states]
+    assert after == [plain.value(board(state[:])) for state in states] and after != before
+    return
@@ -0,0 +1,68 @@
+"""
+training resumed from a checkpoint must end with the same tables and statistic as an uninterrupted run
+"""
+
+from agent import rndenv
+from statistic import statistic
+from episode import episode
+from checkpoint import checkpointer
+import checkpoint
+import contextlib
+import itertools
+import pytest
+import io
+
+
+def agents(small_agent, options):
+    """ a td_learning agent with small tables of two 4-tuples, and its environment """
+    return small_agent([[0, 1, 2, 3], [4, 5, 6, 7]], "seed=1 train " + options), rndenv("seed=2")
+
+
+def train(play, evil, stat, ckpt, count):
+    """ the training loop of 2048.py, until 'count' episodes are played """
+    while stat.count < count:
+        play.open_episode("~:" + evil.name())
+        evil.open_episode(play.name() + ":~")
+        stat.open_episode(play.name() + ":" + evil.name())
+        game = stat.back()
+        afterstates, rewards = game.play(play, evil)
+        win = game.last_turns(play, evil)
+        stat.close_episode(win.name())
+        play.close_episode(win.name())
+        features = play.layout.batch_features(afterstates)
+        play.update_weight(features[:-1], rewards, features[1:])
+        evil.close_episode(win.name())
+        ckpt.step(play, evil, stat)
+    ckpt.wait()
+    return
+
+
+@pytest.mark.parametrize("options, deltas", [("", 0), ("lambda=0.5", 0), ("tc", 2)])
+def test_resume(tmp_path, monkeypatch, small_agent, options, deltas):
+    clock = itertools.count(0, 3)
+    monkeypatch.setattr(episode, "millisec", lambda self: next(clock)) # the speeds in the blocks do not depend on the time
+    path = str(tmp_path / "checkpoint.bin")
+    total, block, every, stop = 24, 5, 4, 12
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        play, evil = agents(small_agent, options)
+        stat = statistic(total, block)
+        train(play, evil, stat, checkpointer(str(tmp_path / "full.bin"), 0), total)
+    full = out.getvalue()
+
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        first, evil = agents(small_agent, options)
+        stat = statistic(total, block)
+        train(first, evil, stat, checkpointer(path, every, deltas), stop)
+        again, evil = agents(small_agent, options)
+        stat = statistic(total, block)
+        assert checkpoint.restore(path, again, evil, stat) == stop
+        train(again, evil, stat, checkpointer(path, every, deltas), total)
+    assert out.getvalue().endswith(full[full.index("%d\tavg" % (stop - stop % block + block)):])
+    for w, v in zip(play.net, again.net):
+        assert w.value.tobytes() == v.value.tobytes()
+        assert (w.error is None) == (v.error is None)
+        if w.error is not None:
+            assert w.error.tobytes() == v.error.tobytes() and w.absolute.tobytes() == v.absolute.tobytes()
+    return
@@ -0,0 +1,70 @@
+"""
+episode.parse() must read the same episodes as load_reference(), and reject the same lines
+"""
+
+from episode import episode, episodes
+from agent import rndenv, player
+import contextlib
+import random
+import io
+
+
+def games(count, seed = 1):
+    """ the lines of 'count' random games with fixed seeds """
+    with contextlib.redirect_stdout(io.StringIO()):
+        play = player("name=dummy seed=%d" % seed)
+        evil = rndenv("seed=%d" % (seed + 1))
+    lines = []
+    for i in range(count):
+        game = episode()
+        game.open_episode("dummy:random")
+        evil.open_episode()
+        game.play(play, evil)
+        game.close_episode("random")
+        lines += [str(game) + "\n"]
+    return lines
+
+
+def same(a, b):
+    """ whether two episodes hold the same moves, times, state and score """
+    return (str(a) == str(b) and a.ep_score == b.ep_score and a.ep_state.state == b.ep_state.state
+            and a.ep_open == b.ep_open and a.ep_close == b.ep_close
+            and [(m[0].code, m[1], m[2]) for m in a.ep_moves] == [(m[0].code, m[1], m[2]) for m in b.ep_moves])
+
+
+def test_games():
+    lines = games(20)
+    for line in lines:
+        ref, ep = episode(), episode()
+        assert ref.load_reference(io.StringIO(line))
+        assert ep.parse(line)
+        assert same(ref, ep)
+    for ep, fast in zip(episodes(io.StringIO("".join(lines))), episodes(io.StringIO("".join(lines)), replay = False)):
+        assert str(ep) == str(fast) and ep.score() == fast.score()
+    return
+
+
+def test_malformed():
+    """ lines with random edits (within one line) are accepted or rejected the same way """
+    lines = games(10)
+    rng = random.Random(1)
+    alphabet = "#URDL?0123456789ABCDEFZ[]()@|- x_+"
+    for i in range(1500):
+        text = list(rng.choice(lines).rstrip("\n"))
+        for k in range(rng.randint(1, 4)):
+            pos, op = rng.randrange(len(text)), rng.random()
+            if op < 0.4:
+                text[pos] = rng.choice(alphabet)
+            elif op < 0.7:
+                del text[pos]
+            else:
+                text.insert(pos, rng.choice(alphabet))
+        line = "".join(text)
+        if rng.random() < 0.3:
+            line = "a@1|" + "".join(rng.choice(alphabet) for k in range(rng.randint(0, 12))) + "|b@2"
+        ref, ep = episode(), episode()
+        accepted = ref.load_reference(io.StringIO(line))
+        assert ep.load(io.StringIO(line)) == accepted, line
+        if accepted:
+            assert same(ref, ep), line
+    return
@@ -0,0 +1,60 @@
+"""
+the binary episode log must give back the episodes written to it, also after a crash while writing
+"""
+
+from eplog import writer, reader, put_varint, from_text, to_text
+from test_episode import games
+from episode import episodes
+import pytest
+import io
+import os
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "episodes.log")
+    lines = games(10)
+    eps = list(episodes(io.StringIO("".join(lines))))
+    log = writer(path)
+    for ep in eps[:6]:
+        log.append(ep)
+    log.close()
+    log = writer(path) # reopening appends
+    for ep in eps[6:]:
+        log.append(ep)
+    log.close()
+    log = reader(path)
+    assert [str(ep) for ep in log] == [str(ep) for ep in eps]
+    assert [ep.score() for ep in log] == [ep.score() for ep in eps]
+    assert len(log) == 10 and str(log[7]) == str(eps[7]) and log[3].state().state == eps[3].state().state
+    log.close()
+    output = io.StringIO()
+    assert to_text(path, output) == 10 and output.getvalue() == "".join(lines)
+    assert from_text(io.StringIO("".join(lines)), str(tmp_path / "copy.log")) == 10
+    return
+
+
+@pytest.mark.parametrize("cut", [1, 3, 4, 5, 20])
+def test_torn_tail(tmp_path, cut):
+    """ a record cut off by a crash is dropped, and the episodes appended afterwards can be read """
+    path = str(tmp_path / "episodes.log")
+    eps = list(episodes(io.StringIO("".join(games(8)))))
+    log = writer(path)
+    for ep in eps[:5]:
+        log.append(ep)
+    log.close()
+    with open(path, 'r+b') as output:
+        output.truncate(os.path.getsize(path) - cut)
+    log = writer(path)
+    for ep in eps[5:]:
+        log.append(ep)
+    log.close()
+    log = reader(path)
+    assert [str(ep) for ep in log] == [str(ep) for ep in eps[:4] + eps[5:]]
+    log.close()
+    return
+
+
+def test_negative():
+    with pytest.raises(ValueError):
+        put_varint(bytearray(), -1)
+    return
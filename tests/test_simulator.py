@@ -0,0 +1,37 @@
+"""
+the games of the lockstep simulator must be reported as episodes that replay to the same results
+"""
+
+from simulator import simulator, greedy_policy
+from statistic import statistic
+from episode import episode
+from action import action
+import contextlib
+import io
+
+
+def play(text):
+    stat = statistic(40, 40)
+    with contextlib.redirect_stdout(io.StringIO()):
+        simulator(16, seed = 1).run(greedy_policy, stat.total, stat, "greedy:random", text)
+    return stat
+
+
+def test_text():
+    stat = play(True)
+    assert len(stat.data) == 40
+    for game in stat.data:
+        ep = episode()
+        assert ep.parse(str(game))
+        assert ep.ep_open[0] == "greedy:random" and ep.ep_close[0] == "random"
+        assert ep.score() == game.score() and ep.state().state == game.state().state
+        for who in [-1, action.slide.type, action.place.type]:
+            assert ep.step(who) == game.step(who)
+    return
+
+
+def test_no_text():
+    stat = play(False)
+    assert all(str(game) == "" for game in stat.data)
+    assert [game.score() for game in stat.data] == [game.score() for game in play(True).data]
+    return
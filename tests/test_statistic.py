@@ -0,0 +1,107 @@
+"""
+the running aggregates of statistic must show the same numbers as summing the last 'block' episodes of data
+"""
+
+from statistic import statistic
+from episode import episodes, outcome
+from action import action
+from test_episode import games
+import contextlib
+import random
+import io
+
+
+def corpus(count):
+    """ the episodes of random games, with random times so that the speeds are defined """
+    rng = random.Random(3)
+    eps = list(episodes(io.StringIO("".join(games(count, seed = 5)))))
+    for ep in eps:
+        ep.ep_moves = [(move, reward, rng.randint(1, 5)) for move, reward, time in ep.ep_moves]
+    return eps
+
+
+def reference(stat, block):
+    """ the first line of show(), computed from the last 'block' episodes of data as statistic once did """
+    blk = min(len(stat.data), block)
+    last = [stat.data[-i] for i in range(1, blk + 1)]
+    ssc, msc = sum(ep.score() for ep in last), max(ep.score() for ep in last)
+    sop, pop, eop = [sum(ep.step(who) for ep in last) for who in [-1, action.slide.type, action.place.type]]
+    sdu, pdu, edu = [sum(ep.time(who) for ep in last) for who in [-1, action.slide.type, action.place.type]]
+    return "%d\t" "avg = %d, max = %d, ops = %d (%d|%d)" % (stat.count, ssc / blk, msc, sop * 1000 / sdu, pop * 1000 / pdu, eop * 1000 / edu)
+
+
+def shown(stat, block = None):
+    """ the first line printed by show(), or by show() with another block size """
+    out = io.StringIO()
+    saved = stat.block
+    stat.block = block or stat.block
+    with contextlib.redirect_stdout(out):
+        stat.show(False)
+    stat.block = saved
+    return out.getvalue().rstrip("\n")
+
+
+def test_show():
+    """ show() reports the last 'block' episodes at any point, not only on block boundaries """
+    eps = corpus(40)
+    for total, block, limit, loaded in [(30, 5, 12, 0), (30, 10, 0, 0), (40, 7, 3, 0), (30, 5, 12, 10), (30, 10, 0, 20), (35, 7, 0, 9)]:
+        stat = statistic(total, block, limit)
+        with contextlib.redirect_stdout(io.StringIO()):
+            if loaded:
+                stat.load(io.StringIO("".join(str(ep) + "\n" for ep in eps[-loaded:])))
+                assert shown(stat) == reference(stat, block)
+            for ep in eps[:total - loaded]:
+                stat.append(ep)
+                assert shown(stat) == reference(stat, block)
+        assert shown(stat, max(len(stat.data), stat.window.count)) == reference(stat, len(stat.data))
+    return
+
+
+def test_blocks():
+    """ the tile table of each block covers the same episodes as its first line """
+    eps = corpus(24)
+    stat = statistic(24, 8)
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        for ep in eps:
+            stat.append(ep)
+    blocks = [text.split("\n") for text in out.getvalue().strip("\n").split("\n\n")]
+    assert len(blocks) == 3
+    for k, lines in enumerate(blocks):
+        last = eps[k * 8:(k + 1) * 8]
+        tiles = [max(ep.state().state) for ep in last]
+        for line in lines[1:]:
+            tile, reach, end = line.split("\t")[1:]
+            index = [t for t in range(64) if (1 << t) & -2 == int(tile)][0]
+            assert float(end.strip("()%")) == tiles.count(index) * 100 / len(last)
+            assert float(reach.strip("%")) == sum(t >= index for t in tiles) * 100 / len(last)
+    return
+
+
+
+def test_merge():
+    """ outcomes merged in ranges are kept and trimmed to 'limit' like appended episodes """
+    eps = corpus(40)
+    outcomes = []
+    for ep in eps:
+        steps = [ep.step(who) for who in [-1, action.slide.type, action.place.type]]
+        times = [ep.time(who) for who in [-1, action.slide.type, action.place.type]]
+        outcomes += [outcome(ep.score(), ep.state().state, steps, times, str(ep))]
+    reports = []
+    for merged in [False, True]:
+        stat = statistic(40, 8, 12)
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            if merged:
+                for start in range(0, 40, 3):
+                    stat.merge(outcomes[start:start + 3])
+            else:
+                for ep in outcomes:
+                    stat.append(ep)
+            stat.summary()
+        assert len(stat.data) == 12 and stat.window.count == 12
+        assert [str(ep) for ep in stat.data] == [str(ep) for ep in eps[-12:]]
+        assert shown(stat, 12) == reference(stat, 12)
+        reports += [out.getvalue()]
+    assert reports[0] == reports[1]
+    return
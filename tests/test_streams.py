@@ -0,0 +1,63 @@
+"""
+the random streams of the agents must give reproducible games, the same for any number of workers
+"""
+
+from agent import weight_agent, rndenv
+from statistic import statistic
+from episode import episode
+import parallel
+import contextlib
+import itertools
+import re
+import io
+
+
+def agents(options = ""):
+    """ a random player and the environment, both seeded """
+    with contextlib.redirect_stdout(io.StringIO()):
+        play = weight_agent("name=dummy init=1 seed=1 " + options)
+        evil = rndenv("seed=2 " + options)
+    play.test = True
+    return play, evil
+
+
+def moves(text):
+    """ the moves of text episodes, without the time marks and usages """
+    return re.sub(r"@\d+|\(\d+\)", "", text)
+
+
+def play_games(count, options = ""):
+    play, evil = agents(options)
+    lines = []
+    for i in range(count):
+        game = episode()
+        game.open_episode(play.name() + ":" + evil.name())
+        evil.open_episode()
+        game.play(play, evil)
+        game.close_episode(evil.name())
+        lines += [str(game)]
+    return moves("\n".join(lines))
+
+
+def test_streams():
+    assert play_games(3) == play_games(3)
+    assert play_games(3, "stream=1") == play_games(3, "stream=1")
+    assert play_games(3) != play_games(3, "stream=1")
+    assert play_games(3, "stream=1") != play_games(3, "stream=2")
+    return
+
+
+def test_workers(monkeypatch):
+    """ game g is played with the streams 'stream=g', so the games do not depend on the number of workers """
+    clock = itertools.count(0, 3)
+    monkeypatch.setattr(episode, "millisec", lambda self: next(clock)) # the blocks never see a time usage of 0
+    results = []
+    for workers in [1, 2, 3]:
+        play, evil = agents()
+        stat = statistic(12, 4)
+        with contextlib.redirect_stdout(io.StringIO()):
+            parallel.evaluate(stat, play, evil, workers, text = True)
+        results += [moves(str(stat))]
+    assert results[0] == results[1] == results[2]
+    assert len(set(results[0].split("\n"))) > 2
+    return
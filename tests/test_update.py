@@ -0,0 +1,38 @@
+"""
+the vectorized end-of-episode update must agree with the exact backward update (option 'update=exact')
+"""
+
+import numpy as np
+import pytest
+
+
+def trajectory(steps, features, size, seed):
+    """
+    the indices and rewards of an episode whose afterstates share no entries, and whose next afterstates
+    use other entries than the afterstates, so the order of the updates does not matter
+    """
+    rng = np.random.default_rng(seed)
+    state_index = rng.permutation(size // 2)[:steps * features].reshape(steps, features)
+    after_state_index = rng.integers(size // 2, size, (steps, features))
+    rewards = rng.integers(0, 30, steps).astype(float)
+    rewards[-1] = -1 # the terminal step
+    return state_index, rewards, after_state_index
+
+
+@pytest.mark.parametrize("options", ["", "lambda=0.5", "tc"])
+def test_exact(small_agent, options):
+    tables = []
+    for mode in ["update=exact", ""]:
+        play = small_agent([[0, 1, 2, 3], [4, 5, 6, 7]], "train alpha=0.1 %s %s" % (mode, options))
+        state_index, rewards, after_state_index = trajectory(40, len(play.lookup), 11 ** 4, 1)
+        rng = np.random.default_rng(2)
+        for w in play.net:
+            w.value[:] = rng.normal(0, 10, len(w)).astype(np.float32)
+        before = [w.value.copy() for w in play.net]
+        for repeat in range(3):
+            play.update_weight(state_index, rewards, after_state_index)
+        tables += [[w.value.copy() for w in play.net]]
+    for exact, batch, value in zip(*tables, before):
+        assert np.allclose(exact, batch, rtol = 1e-6, atol = 1e-6) # the float32 sums may round differently
+        assert np.count_nonzero(batch != value) > 0
+    return
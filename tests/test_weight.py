@@ -0,0 +1,71 @@
+"""
+the weight tables and their file formats
+"""
+
+from weight import weight, save_mapped, map_tables, load_header
+from agent import weight_agent
+import numpy as np
+import contextlib
+import hashlib
+import io
+
+
+def test_coverage():
+    """ coverage counts the entries changed since cover(), also those changed back to 0 """
+    w = weight(8)
+    w.value[:] = np.arange(8, dtype = np.float32) # as loaded, nothing is covered yet
+    w.cover()
+    assert w.coverage() == 0
+    w.add(np.array([1, 3, 3]), np.float32(-1.0)) # entry 1 goes back to 0
+    w[5] = 0.0
+    assert w.coverage() == 3 and w.value[1] == 0.0 and w.value[3] == 1.0
+    w.track()
+    w.changes() # forgetting the changes of delta checkpoints does not forget the coverage
+    assert w.coverage() == 3
+    return
+
+
+
+def test_map_tables(tmp_path):
+    """ save_mapped and map_tables give back the tables, each aligned in the file """
+    path = str(tmp_path / "tables.map")
+    rng = np.random.default_rng(1)
+    tables = [rng.normal(0, 10, size).astype(np.float32) for size in [7, 100, 33]]
+    with open(path, 'wb') as output:
+        save_mapped(output, {'layout': None}, tables)
+    with open(path, 'rb') as input:
+        header = load_header(input)
+        start = input.tell()
+    mapped = map_tables(path, header, start)
+    assert [len(value) for value in mapped] == [7, 100, 33]
+    for value, table in zip(mapped, tables):
+        assert np.array_equal(value, table) and not value.flags.writeable
+    return
+
+
+def test_mapped_agent(tmp_path, small_agent):
+    """ an agent loads a mapped weight file in place, and training on it never changes the file """
+    path = str(tmp_path / "weight.map")
+    play = small_agent([[0, 1, 2, 3], [4, 5, 6, 7]])
+    rng = np.random.default_rng(2)
+    for w in play.net:
+        w.value[:] = rng.normal(0, 10, len(w)).astype(np.float32)
+    play.save_mapped(path)
+    digest = hashlib.md5(open(path, 'rb').read()).hexdigest()
+    with contextlib.redirect_stdout(io.StringIO()):
+        loaded = weight_agent("name=td_learning load=%s" % path)
+        trained = weight_agent("name=td_learning load=%s train alpha=0.1" % path)
+    assert loaded.mapped and trained.mapped
+    for w, v in zip(play.net, loaded.net):
+        assert np.array_equal(w.value, v.value)
+    features = trained.layout.batch_features(np.arange(48).reshape(3, 16) % 8)
+    trained.update_weight(features[:-1], [3, -1], features[1:])
+    assert any(not np.array_equal(w.value, v.value) for w, v in zip(play.net, trained.net))
+    assert hashlib.md5(open(path, 'rb').read()).hexdigest() == digest
+    trained.save_weight(str(tmp_path / "trained.map"))
+    with contextlib.redirect_stdout(io.StringIO()):
+        again = weight_agent("name=td_learning load=%s" % (tmp_path / "trained.map"))
+    assert again.mapped
+    for w, v in zip(trained.net, again.net):
+        assert np.array_equal(w.value, v.value)
+    return
@@ -9,12 +9,20 @@ Author: Hung Guei (moporgic)
 """
 
 from array import array
+import numpy as np
+import json
 
 
 class weight:
+    """ a table of float32 weights stored in a contiguous numpy array """
     
     def __init__(self, len = 0):
-        self.value = [0] * len
+        self.value = np.zeros(len, dtype = np.float32)
+        self.scale = 1.0 # the weights are value * scale, for quantized tables
+        self.touched = None # the entries changed since the last changes(), once track() is called
+        self.covered = None # the entries ever changed, once cover() is called
+        self.error = None # the accumulated errors of temporal coherence, once coherence() is called
+        self.absolute = None # the accumulated absolute errors of temporal coherence
         return
     
     def __getitem__(self, index):
@@ -22,24 +30,201 @@ class weight:
     
     def __setitem__(self, index, value):
         self.value[index] = value
+        if self.touched is not None:
+            self.touched[index] = True
+        if self.covered is not None:
+            self.covered[index] = True
         return
     
     def __len__(self):
         return len(self.value)
     
+    def add(self, index, delta):
+        """ add 'delta' to the entries at 'index', repeated indices accumulate """
+        np.add.at(self.value, index, delta)
+        if self.touched is not None:
+            self.touched[index] = True
+        if self.covered is not None:
+            self.covered[index] = True
+        return
+    
+    def coherence(self, enable = True):
+        """ allocate (or drop) the accumulated error E and absolute error A of temporal coherence, one pair per entry """
+        if not enable:
+            self.error, self.absolute = None, None
+        elif self.error is None:
+            self.error = np.zeros(len(self.value), dtype = np.float32)
+            self.absolute = np.zeros(len(self.value), dtype = np.float32)
+        return
+    
+    def adapt(self, index, error, alpha):
+        """
+        temporal coherence update: add alpha * |E| / A * error to the entries at 'index', where the rate |E| / A
+        (1 while A = 0) is taken before the update, then accumulate 'error' into E and its magnitude into A
+        """
+        absolute = self.absolute[index]
+        rate = np.abs(self.error[index]) / np.where(absolute > 0, absolute, 1) + (absolute == 0)
+        error = np.asarray(error, dtype = np.float32) # np.add.at is much slower when it has to cast the values
+        self.add(index, (alpha * rate * error).astype(np.float32))
+        np.add.at(self.error, index, error)
+        np.add.at(self.absolute, index, np.abs(error))
+        return
+    
+    def arrays(self):
+        """ the table and its companion arrays, in the order they are saved """
+        return [self.value] if self.error is None else [self.value, self.error, self.absolute]
+    
+    def track(self):
+        """ start recording which entries are changed, one flag per entry """
+        self.touched = np.zeros(len(self.value), dtype = bool)
+        return
+    
+    def changes(self):
+        """ the indices and the values (of each of arrays()) of the entries changed since the last call, and forget them """
+        index = np.flatnonzero(self.touched).astype(np.uint32)
+        self.touched[index] = False
+        return index, [value[index] for value in self.arrays()]
+    
+    def cover(self):
+        """ start recording which entries are ever changed, unlike touched they are never forgotten """
+        self.covered = np.zeros(len(self.value), dtype = bool)
+        return
+    
+    def coverage(self):
+        """ the number of entries changed by some update since cover() """
+        return int(np.count_nonzero(self.covered)) if self.covered is not None else 0
+    
     def save(self, output):
-        """ serialize this weight to a file object """
-        array('Q', [len(self.value)]).tofile(output)
-        array('f', self.value).tofile(output)
+        """ serialize this weight (and its companion arrays) to a file object """
+        for value in self.arrays():
+            array('Q', [len(value)]).tofile(output)
+            value.tofile(output)
         return True
     
-    def load(self, input):
-        """ deserialize from a file object """
+    def load(self, input, dtype = np.float32, coherence = False):
+        """ deserialize from a file object, 'dtype' is the type of the stored entries """
+        self.value = read(input, dtype)
+        if coherence:
+            self.error, self.absolute = read(input, np.float32), read(input, np.float32)
+        return True
+
+
+def read(input, dtype):
+    """ read an array saved with its length """
+    size = array('Q')
+    size.fromfile(input, 1)
+    size = size[0]
+    value = np.fromfile(input, dtype = dtype, count = size)
+    if len(value) < size:
+        raise EOFError("read() didn't return enough bytes")
+    return value
+
+
+def quantize(value, dtype):
+    """
+    the quantized entries of a float table and their scale, so that value ~= quantized * scale
+    int16 maps the largest magnitude to 32767, float16 maps it to 1
+    """
+    peak = float(np.abs(value).max()) if len(value) else 0.0
+    if np.dtype(dtype) == np.int16:
+        scale = peak / 32767 if peak else 1.0
+        return np.clip(np.rint(value / scale), -32767, 32767).astype(np.int16), scale
+    if np.dtype(dtype) == np.float16:
+        scale = peak if peak else 1.0
+        return (value / scale).astype(np.float16), scale
+    raise ValueError("unsupported quantized type %s" % dtype)
+
+
+magic = b'NTUP' # the first bytes of a weight file with a header, a plain file starts with the table count
+align = 64 # the alignment of the tables of a mapped weight file, in bytes
+
+def save_header(output, header, version = 1):
+    """
+    write the magic, the format version and a JSON header (e.g. the tuple layout) before the tables
+    version 1 is followed by the table count and the tables, version 2 is a mapped weight file, see save_mapped
+    """
+    data = json.dumps(header).encode()
+    output.write(magic)
+    array('I', [version, len(data)]).tofile(output)
+    output.write(data)
+    return True
+
+def pad(output):
+    """ write zeros up to the next multiple of 'align' bytes """
+    output.write(b"\0" * (-output.tell() % align))
+    return
+
+def save_mapped(output, header, tables):
+    """
+    write a mapped weight file: a version 2 header whose 'tables' hold the offset and the size of each table,
+    then the raw tables, each starting at a multiple of 'align' bytes, so they can be mapped and used in place
+    the offsets are relative to the data, which starts at the first multiple of 'align' after the header
+    """
+    entries, offset = [], 0
+    for value in tables:
+        entries += [{"offset": offset, "size": len(value)}]
+        offset += -(-value.nbytes // align) * align
+    header = dict(header, tables = entries, dtype = np.dtype(tables[0].dtype if tables else np.float32).name)
+    save_header(output, header, 2)
+    pad(output)
+    for value in tables:
+        value.tofile(output)
+        pad(output)
+    return True
+
+def map_tables(path, header, start, mode = 'r'):
+    """
+    the tables of a mapped weight file as arrays backed by the file, no data is read until it is used
+    'start' is the end of the header, 'mode' is 'r' for read-only, or 'c' for private copies of the written pages
+    """
+    data = -(-start // align) * align
+    dtype = np.dtype(header['dtype'])
+    return [np.memmap(path, dtype = dtype, mode = mode, offset = data + table['offset'], shape = (table['size'],))
+            if table['size'] else np.zeros(0, dtype = dtype) for table in header['tables']]
+
+def save_delta(output, header, changes):
+    """
+    write a delta checkpoint: a header, then the (indices, values) of the changed entries of each table
+    with temporal coherence ('coherence' in the header), the values of E and A follow those of the table
+    """
+    save_header(output, header)
+    array('I', [len(changes)]).tofile(output)
+    for index, values in changes:
+        array('Q', [len(index)]).tofile(output)
+        index.astype(np.uint32).tofile(output)
+        for value in values:
+            value.astype(np.float32).tofile(output)
+    return True
+
+def load_delta(input, net):
+    """ apply a delta checkpoint to the tables of 'net', return its header """
+    header = load_header(input)
+    if header is None or 'delta' not in header:
+        raise ValueError("not a delta checkpoint")
+    count = array('I')
+    count.fromfile(input, 1)
+    if count[0] != len(net):
+        raise ValueError("%d tables in the delta, but %d in the net" % (count[0], len(net)))
+    for w in net:
         size = array('Q')
         size.fromfile(input, 1)
-        size = size[0]
-        value = array('f')
-        value.fromfile(input, size)
-        self.value = list(value)
-        return True
-    
+        index = np.fromfile(input, dtype = np.uint32, count = size[0])
+        arrays = w.arrays() if header.get('coherence') else [w.value]
+        for target in arrays:
+            value = np.fromfile(input, dtype = np.float32, count = size[0])
+            if len(value) < size[0]:
+                raise EOFError("read() didn't return enough bytes")
+            target[index] = value
+    return header
+
+def load_header(input):
+    """ read the header written by save_header, or return None and rewind if the file has no header """
+    pos = input.tell()
+    if input.read(len(magic)) != magic:
+        input.seek(pos)
+        return None
+    version = array('I')
+    version.fromfile(input, 2)
+    if version[0] not in [1, 2]:
+        raise ValueError("unsupported weight file version %d" % version[0])
+    return json.loads(input.read(version[1]).decode())